@@ -1,5 +1,9 @@
+import os
+
 # MIDI Configuration
-MIDI_DEVICE_NAME_SUBSTRING = "MINILAB3 MIDI" # Substring to identify the Minilab3 MIDI ports
+# Substring to identify the Minilab3 MIDI ports. em_pd_controller sets EMBLISS_MIDI_PORT
+# to its broker port (em_ml3_embliss), which stands in for the Minilab3.
+MIDI_DEVICE_NAME_SUBSTRING = os.environ.get("EMBLISS_MIDI_PORT", "MINILAB3 MIDI")
 DEFAULT_MIDI_CHANNEL = 1 # MIDI channel for most controls (0-15, so 1 is Channel 2 in some DAWs)
 PADS_MIDI_CHANNEL = 10 # MIDI channel for drum pads (0-15, so 10 is Channel 11 in some DAWs)
 
@@ -72,5 +76,6 @@ SETS_DIR_PATH = "/home/patch/repos/emsys/sets"
 MSET_FILE_EXTENSION = ".mset"
 
 # Application Behavior
-POLLING_INTERVAL = 0.005  # Reduced from 0.02 (20ms) to 5ms for faster MIDI processing
-RECONNECT_INTERVAL = 5   # Seconds to wait before retrying MIDI connection
\ No newline at end of file
+RECONNECT_INTERVAL = 5   # Seconds to wait before retrying MIDI connection
+SYSEX_SEND_INTERVAL = 0.05  # Gap the display writer leaves after each SysEx, so the Minilab3 keeps up
+DISPLAY_FLUSH_TIMEOUT = 1  # How long closing the ports waits for queued SysEx to go out
\ No newline at end of file
@@ -1,7 +1,12 @@
+import argparse
 import time
 import logging
+import os
+import queue
 import signal
+import socket
 import sys
+import threading
 
 from . import config
 from .midi_handler import MidiHandler
@@ -20,72 +25,152 @@ logger = logging.getLogger(__name__) # Logger for this main module
 
 # --- Global Variables ---
 running = True
-midi_handler_instance = None # To be accessible by signal_handler
+midi_handler_instance = None
 
-# --- Signal Handler for Graceful Exit ---
-def signal_handler(sig, frame):
-    global running, midi_handler_instance
-    logger.info(f"Signal {signal.Signals(sig).name} received. Shutting down Embliss...")
-    running = False
-    # Cleanup will happen in the finally block of the main loop
+# SIGUSR1 activates a --standby instance (takes input and the display), SIGUSR2
+# parks it again. The ports stay open throughout, so neither rescans or reloads. All of these are read from the same queue as MIDI input
+# rather than handled asynchronously, so they take effect between messages.
+CONTROL_SIGNALS = {signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2}
+
+# --- Readiness ---
+def notify(state="READY=1"):
+    """Tells whoever launched us (em_pd_controller, or systemd) about our state, sd_notify style.
+
+    READY=1 means the display is up; STATUS=standby that input and the display are let go.
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(state.encode(), address)
+        logger.debug(f"Sent {state} notification.")
+    except OSError as e:
+        logger.warning(f"Failed to send {state} notification: {e}")
 
-def main():
+def _signal_listener(event_queue):
+    while True:
+        event_queue.put(signal.Signals(signal.sigwaitinfo(CONTROL_SIGNALS).si_signo))
+
+def park(midi_handler):
+    """Hands the Minilab3 back: clears the display and stops taking input. The ports stay open."""
+    if midi_handler.is_connected() and midi_handler.active:
+        logger.info("Clearing Minilab3 display...")
+        midi_handler.update_display(" ", " ")
+    midi_handler.set_active(False)
+
+def main(standby=False):
     global running, midi_handler_instance
     logger.info("Starting Embliss Set Management Application...")
 
+    # Blocked before any other thread exists, so only the listener receives them
+    signal.pthread_sigmask(signal.SIG_BLOCK, CONTROL_SIGNALS)
+    # Control signals and MIDI input (from rtmidi's callback) in arrival order
+    event_queue = queue.Queue()
+    threading.Thread(target=_signal_listener, args=(event_queue,), name="signals", daemon=True).start()
+
     # Initialize core components
-    midi_handler_instance = MidiHandler()
+    midi_handler_instance = MidiHandler(message_queue=event_queue, active=not standby)
     set_manager_instance = SetManager() # Loads sets on init
+    # Created once the ports are open, so the first screen isn't drawn into nothing.
+    # It's kept while parked, so activating only repaints it.
+    screen_manager_instance = None
+    active = not standby
 
-    # Check if MIDI connection was successful
-    if not midi_handler_instance.is_connected():
-        logger.warning("MIDI ports not connected. Display/control will be unavailable.")
-        # Decide if you want to proceed or exit. For now, let's proceed but it won't be very useful.
-        # You might want a loop here to retry connection or wait.
-        # For simplicity, we'll let it run, and the midi_handler will keep trying.
-
-    # Initialize ScreenManager with the initial screen
-    # Pass set_manager to ScreenManager if screens need it (SetListScreen does)
-    screen_manager_instance = ScreenManager(midi_handler_instance, 
-                                            initial_screen_class=SetListScreen,
-                                            set_manager=set_manager_instance)
-
-    # Register signal handlers for SIGINT (Ctrl+C) and SIGTERM
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-
-    logger.info("Embliss initialized. Entering main loop...")
+    if standby:
+        if midi_handler_instance.is_connected():
+            # Drawn into nothing for now: the handler holds frames back until activated
+            screen_manager_instance = ScreenManager(midi_handler_instance,
+                                                    initial_screen_class=SetListScreen,
+                                                    set_manager=set_manager_instance)
+        logger.info("Embliss initialized in standby. Waiting for SIGUSR1...")
+        notify("STATUS=standby")
+    else:
+        logger.info("Embliss initialized. Entering main loop...")
+    ready_notified = False
+    wait = None if standby else 0 # How long the next iteration may block; None until an event arrives
     try:
         while running:
+            # 0. Block until MIDI input, a control signal or the current screen's
+            #    next deadline, then take everything that's queued in one go
+            try:
+                events = [event_queue.get(timeout=wait)]
+            except queue.Empty:
+                events = []
+            while True:
+                try:
+                    events.append(event_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for event in events:
+                if not isinstance(event, signal.Signals):
+                    if active and screen_manager_instance is not None: # Else left over from before parking
+                        logger.debug(f"MIDI In: {event}")
+                        screen_manager_instance.process_midi_input(event)
+                elif event in (signal.SIGINT, signal.SIGTERM):
+                    logger.info(f"Signal {event.name} received. Shutting down Embliss...")
+                    running = False
+                    break
+                elif event == signal.SIGUSR1 and not active:
+                    logger.info("Activating from standby...")
+                    midi_handler_instance.set_active(True)
+                    if screen_manager_instance is not None:
+                        screen_manager_instance.redraw() # Back where it was parked
+                    active = True
+                    ready_notified = False
+                elif event == signal.SIGUSR2 and active:
+                    logger.info("Returning to standby...")
+                    park(midi_handler_instance)
+                    active = False
+                    notify("STATUS=standby")
+            if not running:
+                break
+            if not active:
+                wait = None # A parked instance just waits for the next signal
+                continue
+
             # 1. Ensure MIDI ports are open (attempt reconnect if necessary)
             if not midi_handler_instance.ensure_ports_open():
                 # If still not connected after trying, wait before next attempt
                 logger.debug(f"MIDI not connected. Waiting {config.RECONNECT_INTERVAL}s to retry.")
-                time.sleep(config.RECONNECT_INTERVAL)
+                wait = config.RECONNECT_INTERVAL
                 continue # Skip processing this iteration if no MIDI
+            if screen_manager_instance is None:
+                # Pass set_manager to ScreenManager if screens need it (SetListScreen does)
+                screen_manager_instance = ScreenManager(midi_handler_instance,
+                                                        initial_screen_class=SetListScreen,
+                                                        set_manager=set_manager_instance)
 
-            # 2. Process incoming MIDI messages
-            message = midi_handler_instance.get_message() # Non-blocking poll
-            if message:
-                logger.debug(f"MIDI In: {message}")
-                screen_manager_instance.process_midi_input(message)
-
-            # 3. Allow current screen to update itself (if needed for animations, etc.)
+            # 2. Allow current screen to update itself (throttled redraws, timeouts)
             screen_manager_instance.update_current_screen()
-            
-            # 4. Sleep for a short interval to prevent high CPU usage
-            time.sleep(config.POLLING_INTERVAL)
+            if not ready_notified:
+                # MIDI is up and the first screen has been drawn
+                notify()
+                ready_notified = True
+
+            # 3. Sleep until the screen's next deadline, or until input if it has none
+            deadline = screen_manager_instance.next_update_time()
+            wait = None if deadline is None else max(0, deadline - time.time())
 
     except Exception as e:
         logger.error(f"An unexpected error occurred in the main loop: {e}", exc_info=True)
     finally:
         logger.info("Exiting Embliss main loop.")
         if midi_handler_instance:
-            logger.info("Clearing Minilab3 display...")
-            midi_handler_instance.update_display(" ", " ") # Clear display
+            park(midi_handler_instance)
             logger.info("Closing MIDI ports...")
             midi_handler_instance.close_ports()
         logger.info("Embliss shutdown complete.")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Embliss set management on the Minilab3")
+    parser.add_argument('--standby', action='store_true',
+                        help="load everything and open the ports, but leave input and the display "
+                             "alone until SIGUSR1 (SIGUSR2 returns to standby)")
+    return parser.parse_args(argv)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main(parse_args().standby)
\ No newline at end of file
@@ -1,17 +1,44 @@
 import mido
+import queue
+import threading
 import time
 import logging
+from collections import deque
 from . import config
 
 # Configure logging for this module
 logger = logging.getLogger(__name__)
 
+# System real-time messages, dropped on arrival so they don't wake the main loop
+IGNORED_MESSAGE_TYPES = ('clock', 'start', 'continue', 'stop', 'active_sensing', 'reset')
+
 class MidiHandler:
-    def __init__(self, device_name_substring=config.MIDI_DEVICE_NAME_SUBSTRING):
+    def __init__(self, device_name_substring=config.MIDI_DEVICE_NAME_SUBSTRING, connect=True, message_queue=None,
+                 active=True):
         self.device_name_substring = device_name_substring
         self.in_port = None
         self.out_port = None
-        self._connect_ports()
+        # Input and display frames only flow while active. A parked --standby
+        # instance keeps its ports open, so a handoff is just set_active().
+        self.active = active
+        # Input arrives on rtmidi's callback thread and waits here. main.py passes
+        # the queue its control signals go to, so one blocking get() waits for both.
+        self.messages = message_queue if message_queue is not None else queue.Queue()
+        # SysEx goes out on the display writer thread, paced by
+        # config.SYSEX_SEND_INTERVAL, so callers never wait on the Minilab3.
+        # Other SysEx is sent in order, ahead of display frames; of those only
+        # the latest is kept, so fast scrolling skips frames instead of lagging.
+        self._output_lock = threading.Lock()
+        self._writer_wakeup = threading.Condition()
+        self._sysex_queue = deque()  # (data, description)
+        self._pending_frame = None
+        self._writer_busy = False
+        threading.Thread(target=self._display_writer, name="display writer", daemon=True).start()
+        if connect:
+            self._connect_ports()
+        else:
+            # Standby: load the backend (rtmidi) now so opening the ports later is quick
+            mido.backend.load()
 
     def _find_midi_port_name(self, port_names_func, port_type="input"):
         """Generic function to find a MIDI port by substring in its name."""
@@ -35,7 +62,7 @@ class MidiHandler:
 
         if input_port_name:
             try:
-                self.in_port = mido.open_input(input_port_name)
+                self.in_port = mido.open_input(input_port_name, callback=self._on_message)
                 logger.info(f"Successfully opened MIDI input on '{self.in_port.name}'")
                 opened_input = True
             except Exception as e:
@@ -60,18 +87,56 @@ class MidiHandler:
             logger.warning("One or both MIDI ports could not be opened. Retrying will be necessary.")
 
 
+    def set_active(self, active):
+        """Takes input and the display (True), or lets go of them once queued SysEx is out. Ports stay open."""
+        if not active and not self.flush():
+            logger.warning("Display writer did not catch up before parking.")
+        with self._writer_wakeup:
+            self.active = active
+            if not active:
+                # Nothing drawn for this activation should reach the next one
+                self._sysex_queue.clear()
+                self._pending_frame = None
+
     def send_sysex_message(self, sysex_data_tuple, description="SysEx"):
-        """Sends a SysEx message using the provided mido output port."""
-        if not self.out_port or self.out_port.closed:
-            logger.warning(f"Cannot send {description}: Output port not available or closed.")
-            return
-        try:
-            msg = mido.Message('sysex', data=sysex_data_tuple)
-            self.out_port.send(msg)
-            logger.debug(f"Sent {description} message (data: {sysex_data_tuple})")
-            time.sleep(0.05)  # Small delay after sending SysEx, can be tuned
-        except Exception as e:
-            logger.error(f"Failed to send {description} message: {e}")
+        """Queues a SysEx message for the display writer, after any queued before it."""
+        with self._writer_wakeup:
+            self._sysex_queue.append((sysex_data_tuple, description))
+            self._writer_wakeup.notify_all()
+
+    def _send_now(self, sysex_data_tuple, description):
+        with self._output_lock:
+            if not self.out_port or self.out_port.closed:
+                logger.warning(f"Cannot send {description}: Output port not available or closed.")
+                return
+            try:
+                msg = mido.Message('sysex', data=sysex_data_tuple)
+                self.out_port.send(msg)
+                logger.debug(f"Sent {description} message (data: {sysex_data_tuple})")
+            except Exception as e:
+                logger.error(f"Failed to send {description} message: {e}")
+
+    def _display_writer(self):
+        while True:
+            with self._writer_wakeup:
+                self._writer_wakeup.wait_for(lambda: self._sysex_queue or self._pending_frame is not None)
+                if self._sysex_queue:
+                    sysex_data, description = self._sysex_queue.popleft()
+                else:
+                    sysex_data, description = self._pending_frame, "Minilab3 Display Update"
+                    self._pending_frame = None
+                self._writer_busy = True
+            self._send_now(sysex_data, description)
+            with self._writer_wakeup:
+                self._writer_busy = False
+                self._writer_wakeup.notify_all()
+            time.sleep(config.SYSEX_SEND_INTERVAL)
+
+    def flush(self, timeout=config.DISPLAY_FLUSH_TIMEOUT):
+        """Waits until all queued SysEx has been sent. Returns False on timeout."""
+        with self._writer_wakeup:
+            return self._writer_wakeup.wait_for(
+                lambda: not self._sysex_queue and self._pending_frame is None and not self._writer_busy, timeout)
 
     def construct_text_sysex_data(self, line1_text="", line2_text=""):
         """Constructs the data tuple for a Minilab3 text display SysEx message."""
@@ -97,27 +162,32 @@ class MidiHandler:
             return None
 
     def update_display(self, line1, line2):
-        """Constructs and sends the SysEx message to update the Minilab3 display."""
+        """Queues a frame for the Minilab3 display, replacing any frame not sent yet. Doesn't block."""
         sysex_data = self.construct_text_sysex_data(line1, line2)
         if sysex_data:
-            self.send_sysex_message(sysex_data, "Minilab3 Display Update")
+            with self._writer_wakeup:
+                if not self.active:
+                    return # Parked: someone else has the display
+                self._pending_frame = sysex_data
+                self._writer_wakeup.notify_all()
         else:
             logger.warning("Could not update display because SysEx data construction failed.")
             
-    def get_message(self, block=False):
+    def _on_message(self, msg):
+        """rtmidi input callback, on its own thread."""
+        # Ignore system real-time messages to avoid spamming the application.
+        if self.active and msg.type not in IGNORED_MESSAGE_TYPES:
+            self.messages.put(msg)
+
+    def get_message(self, block=False, timeout=None):
         """
-        Gets a MIDI message from the input port, ignoring system real-time messages.
+        Gets the next queued MIDI message, or None. With block, waits up to
+        timeout seconds for one (None: until one arrives).
         """
-        if self.in_port and not self.in_port.closed:
-            while True:
-                msg = self.in_port.poll()
-                if msg is None:
-                    # No more messages in the queue
-                    return None
-                # Ignore system real-time messages to avoid spamming the application.
-                if msg.type not in ('clock', 'start', 'continue', 'stop', 'active_sensing', 'reset'):
-                    return msg
-        return None
+        try:
+            return self.messages.get(block, timeout)
+        except queue.Empty:
+            return None
 
     def ensure_ports_open(self):
         """Checks if ports are open and tries to reconnect if not."""
@@ -135,7 +205,13 @@ class MidiHandler:
                (self.out_port is not None and not self.out_port.closed)
 
     def close_ports(self):
-        """Closes MIDI input and output ports if they are open."""
+        """Closes MIDI input and output ports if they are open, once queued SysEx has gone out."""
+        if not self.flush():
+            logger.warning("Display writer did not catch up before closing the ports.")
+        with self._writer_wakeup:
+            # Nothing meant for this connection should reach the next one
+            self._sysex_queue.clear()
+            self._pending_frame = None
         if self.in_port and not self.in_port.closed:
             try:
                 self.in_port.close()
@@ -144,13 +220,14 @@ class MidiHandler:
                 logger.error(f"Error closing MIDI input port: {e}")
         self.in_port = None
 
-        if self.out_port and not self.out_port.closed:
-            try:
-                self.out_port.close()
-                logger.info("MIDI output port closed.")
-            except Exception as e:
-                logger.error(f"Error closing MIDI output port: {e}")
-        self.out_port = None
+        with self._output_lock:
+            if self.out_port and not self.out_port.closed:
+                try:
+                    self.out_port.close()
+                    logger.info("MIDI output port closed.")
+                except Exception as e:
+                    logger.error(f"Error closing MIDI output port: {e}")
+            self.out_port = None
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -164,10 +241,9 @@ if __name__ == '__main__':
         start_time = time.time()
         try:
             while time.time() - start_time < 10:
-                msg = handler.get_message()
+                msg = handler.get_message(block=True, timeout=0.5)
                 if msg:
                     logger.info(f"Received MIDI: {msg}")
-                time.sleep(0.01)
         except KeyboardInterrupt:
             logger.info("Test interrupted.")
         finally:
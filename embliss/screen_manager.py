@@ -30,7 +30,18 @@ class ScreenManager:
             self.current_screen.handle_midi_input(message)
             # If a screen needs to change, it should call self.screen_manager.change_screen()
 
+    def redraw(self):
+        """Shows the current screen again, e.g. after getting the display back."""
+        if self.current_screen:
+            self.current_screen.display()
+
     def update_current_screen(self):
         """Periodically update the current screen if it has an update method."""
         if self.current_screen and hasattr(self.current_screen, 'update'):
-            self.current_screen.update()
\ No newline at end of file
+            self.current_screen.update()
+
+    def next_update_time(self):
+        """When the current screen next needs update_current_screen(), or None."""
+        if self.current_screen:
+            return self.current_screen.next_update_time()
+        return None
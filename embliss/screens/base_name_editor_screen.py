@@ -74,6 +74,11 @@ class BaseNameEditorScreen(BaseScreen):
             logger.debug(f"Throttled display update for {self.__class__.__name__} executing.")
             self.display() # Call the subclass's display method
 
+    def next_update_time(self):
+        if self.active and self.display_update_pending:
+            return self.last_actual_display_time + self.display_refresh_interval
+        return None
+
     def activate(self):
         super().activate() # This will call the subclass's display method
         self.display_update_pending = True # Ensure display updates on activation
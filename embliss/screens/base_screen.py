@@ -47,4 +47,12 @@ class BaseScreen(ABC):
         or display even without direct MIDI input (e.g., for animations, polling).
         By default, does nothing. Screens can override this if needed.
         """
-        pass
\ No newline at end of file
+        pass
+
+    def next_update_time(self):
+        """
+        When update() next has something to do, as a time.time() value, or
+        None if it has nothing pending. The main loop sleeps until then unless
+        MIDI input arrives first, so screens overriding update() override this too.
+        """
+        return None
\ No newline at end of file
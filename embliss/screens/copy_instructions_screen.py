@@ -117,4 +117,9 @@ class CopyInstructionsScreen(BaseScreen):
     def update(self):
         if not self.active: return
         if self.display_update_pending and (time.time() - self.last_actual_display_time >= self.display_refresh_interval):
-            self.display()
\ No newline at end of file
+            self.display()
+
+    def next_update_time(self):
+        if self.active and self.display_update_pending:
+            return self.last_actual_display_time + self.display_refresh_interval
+        return None
\ No newline at end of file
@@ -214,4 +214,9 @@ class SegmentListScreen(BaseScreen):
         
         current_time = time.time()
         if self.display_update_pending and (current_time - self.last_actual_display_time >= self.display_refresh_interval):
-            self.display()
\ No newline at end of file
+            self.display()
+
+    def next_update_time(self):
+        if self.active and self.display_update_pending:
+            return self.last_actual_display_time + self.display_refresh_interval
+        return None
\ No newline at end of file
@@ -270,6 +270,15 @@ class SetListScreen(BaseScreen):
         if self.display_update_pending and (current_time - self.last_actual_display_time >= self.display_refresh_interval):
             self.display()
 
+    def next_update_time(self):
+        if not self.active: return None
+        deadlines = []
+        if self.awaiting_delete_confirm:
+            deadlines.append(self.first_del_press_time + self.delete_confirm_timeout)
+        if self.display_update_pending:
+            deadlines.append(self.last_actual_display_time + self.display_refresh_interval)
+        return min(deadlines, default=None)
+
     def _perform_delete(self, filename_to_delete):
         full_path = os.path.join(config.SETS_DIR_PATH, filename_to_delete)
         logger.info(f"Attempting to delete set: {full_path}")
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+# Startup phases from every emsys service, appended as JSON lines. One line per
+# phase keeps it cheap enough to leave on; the report picks out the current boot.
+BOOT_TRACE_FILE = os.environ.get('EM_BOOT_TRACE', os.path.join(tempfile.gettempdir(), 'em_boottrace.jsonl'))
+
+def _boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+BOOT_ID = _boot_id()
+
+def since_boot_s():
+    # CLOCK_BOOTTIME counts from kernel start and includes suspend; elsewhere fall back to monotonic.
+    if hasattr(time, 'CLOCK_BOOTTIME'):
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    return time.monotonic()
+
+def trace(service, phase, **fields):
+    """Records that service reached phase, timestamped in seconds since boot."""
+    entry = {'t': round(since_boot_s(), 6), 'boot': BOOT_ID, 'service': service, 'phase': phase,
+             'pid': os.getpid()}
+    entry.update(fields)
+    try:
+        # A single short append is atomic, so services can share the file.
+        with open(BOOT_TRACE_FILE, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+
+def notify(**fields):
+    """Sends a systemd notification (sd_notify protocol), e.g. notify(READY=1).
+
+    Returns False when not started by systemd (or a ReadinessListener), so
+    callers needn't care how they were launched.
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    message = "\n".join(f"{key}={value}" for key, value in fields.items()).encode()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(message, address)
+    except OSError:
+        return False
+    return True
+
+def notify_ready(status=None):
+    if status:
+        return notify(READY=1, STATUS=status)
+    return notify(READY=1)
+
+class ReadinessListener:
+    """Receives sd_notify READY=1 from a child process.
+
+    Pass env() into the child's environment; it then signals readiness the
+    same way a service signals systemd, instead of the parent guessing with
+    a sleep.
+    """
+    def __init__(self, name):
+        self.name = f"{name}-{os.getpid()}"
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Abstract namespace: nothing on disk to clean up.
+        self.sock.bind('\0' + self.name)
+
+    def env(self):
+        return {'NOTIFY_SOCKET': '@' + self.name}
+
+    def wait_ready(self, timeout, alive=None, poll_interval=0.1):
+        """True once READY=1 arrives; False on timeout or if alive() turns false."""
+        return self.wait_for('READY=1', timeout, alive, poll_interval)
+
+    def wait_for(self, state, timeout, alive=None, poll_interval=0.1):
+        """Like wait_ready, for any KEY=VALUE line such as STATUS=standby."""
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            if alive is not None and not alive():
+                return False
+            self.sock.settimeout(min(poll_interval, remaining))
+            try:
+                message = self.sock.recv(4096).decode(errors='replace')
+            except socket.timeout:
+                continue
+            if state in message.split("\n"):
+                return True
+        return False
+
+    def close(self):
+        self.sock.close()
+
+def load_trace(path=BOOT_TRACE_FILE, boot_id=BOOT_ID):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if boot_id is None or entry.get('boot') == boot_id:
+                entries.append(entry)
+    return sorted(entries, key=lambda entry: entry['t'])
+
+def format_report(entries):
+    """Timeline of all phases, then each service's first-to-last span."""
+    if not entries:
+        return "No boot trace entries.\n"
+    lines = [f"{'since boot':>11}  {'delta':>8}  {'service':<18} phase"]
+    previous = entries[0]['t']
+    for entry in entries:
+        extra = {k: v for k, v in entry.items() if k not in ('t', 'boot', 'service', 'phase', 'pid')}
+        detail = f"  {json.dumps(extra)}" if extra else ""
+        lines.append(f"{entry['t']:10.3f}s  {entry['t'] - previous:+7.3f}s  {entry['service']:<18} "
+                     f"{entry['phase']}{detail}")
+        previous = entry['t']
+
+    lines.append("")
+    spans = {}
+    for entry in entries:
+        first = spans.get(entry['service'], (entry['t'],))[0]
+        spans[entry['service']] = (first, entry['t'], entry['phase'])
+    for service, (first, last, last_phase) in sorted(spans.items(), key=lambda item: item[1][1]):
+        lines.append(f"{service:<18} {first:8.3f}s -> {last:8.3f}s  ({last - first:.3f}s, last: {last_phase})")
+    ready = [entry['t'] for entry in entries if entry['phase'] == 'ready']
+    if ready:
+        lines.append(f"\nLast service ready at {max(ready):.3f}s since boot.")
+    return "\n".join(lines) + "\n"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="emsys boot trace report")
+    parser.add_argument('--file', default=BOOT_TRACE_FILE, help=f"trace file (default: {BOOT_TRACE_FILE})")
+    parser.add_argument('--all-boots', action='store_true', help="include entries from earlier boots")
+    parser.add_argument('--output', help="write the report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        report = format_report(load_trace(args.file, None if args.all_boots else BOOT_ID))
+    except FileNotFoundError:
+        sys.exit(f"No boot trace at {args.file}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        sys.stdout.write(report)
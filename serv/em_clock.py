@@ -1,94 +1,643 @@
-from time import perf_counter, sleep
-from multiprocessing import Process, Value, freeze_support
+from time import perf_counter_ns, process_time_ns, sleep, time_ns
+from multiprocessing import Event, Process, freeze_support
+import argparse
+import ctypes
+import ctypes.util
+import json
 import mido
 import logging
+import os
+import platform
 import sys
+import threading
+
+from em_boot import notify_ready, trace
+from em_tempo import STATS_NAME, ClockStats, ClockStatsSnapshot, TempoState, bpm_for_period_ns, period_ns_for_bpm
 
 logging.basicConfig(level=logging.DEBUG)
 
+DEFAULT_LATE_THRESHOLD_US = 1000
+# How long the generator may take to open its outputs before the app gives up
+READY_TIMEOUT = 10.0
+DRIFT_REPORT_INTERVAL_NS = 30 * 1_000_000_000
+
+PPQN = 24
+# Where a tempo change may take effect, in clock ticks since start.
+TEMPO_ALIGN_TICKS = {'none': 0, 'beat': PPQN, 'bar': PPQN * 4}
+
+BPM_MIN, BPM_MAX = 30, 300
+
+TICKS_PER_SIXTEENTH = PPQN // 4
+SPP_MAX = 0x3FFF  # Song Position Pointer is 14 bits of sixteenth notes
+
+# CC 41 values: 127 = start from the top, 64-126 = continue, below 64 = stop.
+CC_START_VALUE = 127
+CC_RUN_THRESHOLD = 64
+
+# High-resolution tempo sysex, using the non-commercial manufacturer ID:
+#   F0 7D 65 6D 01 <centiBPM: 3 x 7 bit, MSB first> F7                        set tempo
+#   F0 7D 65 6D 02 <centiBPM: 3 x 7 bit, MSB first> <beats: 2 x 7 bit> F7     ramp to tempo over beats
+TEMPO_SYSEX_HEADER = (0x7D, 0x65, 0x6D)  # 0x7D, 'e', 'm'
+TEMPO_SYSEX_SET = 0x01
+TEMPO_SYSEX_RAMP = 0x02
+
+def parse_tempo_sysex(data):
+    """Returns (bpm, ramp_beats) for an em_clock tempo sysex payload, or None."""
+    header_len = len(TEMPO_SYSEX_HEADER)
+    if tuple(data[:header_len]) != TEMPO_SYSEX_HEADER or len(data) < header_len + 4:
+        return None
+    command = data[header_len]
+    c1, c2, c3 = data[header_len + 1:header_len + 4]
+    bpm = ((c1 << 14) | (c2 << 7) | c3) / 100
+    if command == TEMPO_SYSEX_SET:
+        return bpm, 0
+    if command == TEMPO_SYSEX_RAMP and len(data) >= header_len + 6:
+        b1, b2 = data[header_len + 4:header_len + 6]
+        return bpm, (b1 << 7) | b2
+    return None
+
+def cc_to_bpm(value):
+    return round(BPM_MIN + value * (BPM_MAX - BPM_MIN) / 127, 2)
+
+class TempoRamp:
+    """Linear BPM glide, advanced one pulse at a time."""
+    def __init__(self, start_bpm, target_bpm, ticks):
+        self.start_bpm = start_bpm
+        self.target_bpm = target_bpm
+        self.ticks = ticks
+        self.step = 0
+
+    @property
+    def done(self):
+        return self.step >= self.ticks
+
+    def next_period_ns(self):
+        self.step += 1
+        bpm = self.start_bpm + (self.target_bpm - self.start_bpm) * min(1.0, self.step / self.ticks)
+        return period_ns_for_bpm(bpm)
+
+class DeadlineScheduler:
+    """Absolute tick timeline: tick N is due at anchor + N * period.
+
+    Deadlines never depend on when the previous send actually happened, so send
+    latency and late wakeups show up as per-tick jitter instead of accumulating
+    into tempo drift.
+    """
+    def __init__(self, period_ns, start_ns):
+        self.period_ns = period_ns
+        self.anchor_ns = start_ns
+        self.tick_index = 0
+        self.ticks_sent = 0
+        self.drift_ns = 0
+        self.drift_total_ns = 0
+        self.worst_drift_ns = 0
+        self.resyncs = 0
+
+    def reanchor(self, period_ns, start_ns):
+        self.period_ns = period_ns
+        self.anchor_ns = start_ns
+        self.tick_index = 0
+
+    def set_period(self, period_ns):
+        # A tempo change takes effect from the next deadline, which was already
+        # scheduled with the old period, so the phase stays continuous.
+        if period_ns != self.period_ns:
+            self.reanchor(period_ns, self.next_deadline())
+
+    def next_deadline(self):
+        return self.anchor_ns + self.tick_index * self.period_ns
+
+    def tick_sent(self, sent_ns):
+        drift = sent_ns - self.next_deadline()
+        self.drift_ns = drift
+        self.drift_total_ns += drift
+        self.worst_drift_ns = max(self.worst_drift_ns, drift)
+        self.ticks_sent += 1
+        self.tick_index += 1
+        if drift > self.period_ns:
+            # Stalled for over a pulse: restart the timeline rather than bursting
+            # out catch-up ticks.
+            self.resyncs += 1
+            self.reanchor(self.period_ns, sent_ns + self.period_ns)
+
+    def drift_report(self):
+        mean_us = self.drift_total_ns / self.ticks_sent / 1000 if self.ticks_sent else 0.0
+        return (f"ticks {self.ticks_sent}, drift last {self.drift_ns / 1000:.1f}us "
+                f"mean {mean_us:.1f}us worst {self.worst_drift_ns / 1000:.1f}us, resyncs {self.resyncs}")
+
+class ClockFollower:
+    """Second-order PLL tracking an incoming MIDI clock.
+
+    Each received pulse is compared with the predicted arrival time; a fraction
+    of the error corrects the phase and a smaller fraction the period. Errors
+    are clamped to half a period so a bursty upstream (USB clocks arriving in
+    clumps) nudges the estimate instead of yanking it. Gains start wide to lock
+    quickly and narrow after the first beat.
+    """
+    ACQUIRE_TICKS = 24
+    ACQUIRE_GAINS = (0.5, 0.0625)
+    LOCKED_GAINS = (0.1, 0.0025)
+
+    def __init__(self, period_ns):
+        self.period_ns = float(period_ns)
+        self.predicted_ns = None
+        self.ticks = 0
+
+    def reset(self):
+        self.predicted_ns = None
+        self.ticks = 0
+
+    def update(self, arrival_ns):
+        """Feeds one pulse; returns the predicted arrival time of the next one."""
+        self.ticks += 1
+        if self.predicted_ns is None:
+            self.predicted_ns = arrival_ns + self.period_ns
+            return self.predicted_ns
+        phase_gain, period_gain = self.ACQUIRE_GAINS if self.ticks <= self.ACQUIRE_TICKS else self.LOCKED_GAINS
+        half = self.period_ns / 2
+        error = max(-half, min(half, arrival_ns - self.predicted_ns))
+        self.period_ns += period_gain * error
+        self.predicted_ns += phase_gain * error + self.period_ns
+        return self.predicted_ns
+
+DEFAULT_OUTPUTS = [('em_clock_out', 0)]
+
+def parse_output_spec(spec):
+    """'NAME[:OFFSET_US]' -> (name, offset_us). Offsets may be negative (send early)."""
+    name, sep, offset = spec.rpartition(':')
+    if sep and name:
+        try:
+            return name, int(offset)
+        except ValueError:
+            pass
+    return spec, 0
+
+class ClockOutputs:
+    """Several clock destinations driven from one timeline.
+
+    Each output has a signed latency offset; its copy of tick N goes out at
+    deadline(N) + offset, so a slow transport can be fed early (negative offset)
+    or a fast one held back, and all of them land together.
+    """
+    def __init__(self, outputs, open_port):
+        # Send in offset order so a single pass of waits covers every output.
+        self.outputs = sorted(((name, offset_us * 1000, open_port(name)) for name, offset_us in outputs),
+                              key=lambda o: o[1])
+        self.lead_ns = max(0, -self.outputs[0][1])
+
+    def send_now(self, msg):
+        for _, _, port in self.outputs:
+            port.send(msg)
+
+    def send_at(self, msg, deadline_ns, waiter):
+        # Returns the worst lateness against each output's own target time.
+        late_ns = None
+        for _, offset_ns, port in self.outputs:
+            target = deadline_ns + offset_ns
+            waiter.wait_until(target)
+            port.send(msg)
+            late = perf_counter_ns() - target
+            late_ns = late if late_ns is None else max(late_ns, late)
+        return late_ns
+
+    def close(self):
+        for _, _, port in self.outputs:
+            port.close()
+
+TIMING_MODES = ('hybrid', 'sleep', 'spin')
+
+CLOCK_MONOTONIC = 1
+TIMER_ABSTIME = 1
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _load_clock_nanosleep():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(_Timespec), ctypes.POINTER(_Timespec)]
+    func.restype = ctypes.c_int
+    return func
+
+class SpinMargin:
+    """Auto-calibrated spin margin for hybrid waits.
+
+    Tracks a slowly decaying peak of how late the kernel wakes us after an
+    absolute sleep, and keeps the spin window just wide enough to cover it.
+    """
+    MIN_NS = 20_000
+    MAX_NS = 2_000_000
+    DECAY = 0.999
+
+    def __init__(self, initial_ns=300_000):
+        self.margin_ns = initial_ns
+        self.peak_ns = initial_ns
+
+    def observe(self, overshoot_ns):
+        self.peak_ns = max(overshoot_ns, self.peak_ns * self.DECAY)
+        self.margin_ns = int(min(self.MAX_NS, max(self.MIN_NS, self.peak_ns * 1.25 + self.MIN_NS)))
+
+class TickWaiter:
+    """Waits until an absolute perf_counter_ns deadline using the selected timing mode.
+
+    hybrid: clock_nanosleep(TIMER_ABSTIME) to just before the deadline, then spin the
+            auto-calibrated margin. Near-zero CPU with sub-100us accuracy.
+    sleep:  clock_nanosleep(TIMER_ABSTIME) to the deadline only. Lowest CPU, accuracy
+            limited by scheduler wakeup latency.
+    spin:   sleep 80% of the remaining time, then busy-spin (original behaviour).
+
+    On Linux perf_counter_ns reads CLOCK_MONOTONIC, the same clock clock_nanosleep
+    waits on. Elsewhere absolute waits fall back to relative sleeps.
+    """
+    def __init__(self, mode='hybrid'):
+        if mode not in TIMING_MODES:
+            raise ValueError(f"Unknown timing mode '{mode}'")
+        self.mode = mode
+        self.margin = SpinMargin()
+        self._clock_nanosleep = _load_clock_nanosleep() if mode != 'spin' else None
+        self._ts = _Timespec()
+        if mode != 'spin' and self._clock_nanosleep is None:
+            logging.warning("clock_nanosleep unavailable, using relative sleeps for absolute waits.")
+
+    def _sleep_until(self, target_ns):
+        if self._clock_nanosleep is not None:
+            self._ts.tv_sec, self._ts.tv_nsec = divmod(target_ns, 1_000_000_000)
+            # Restarts cleanly on EINTR since the target is absolute.
+            while self._clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, ctypes.byref(self._ts), None) != 0:
+                pass
+        else:
+            remaining = target_ns - perf_counter_ns()
+            if remaining > 0:
+                sleep(remaining / 1e9)
+
+    def wait_until(self, deadline_ns):
+        now = perf_counter_ns()
+        if deadline_ns <= now:
+            return
+        if self.mode == 'spin':
+            sleep((deadline_ns - now) * 0.8 / 1e9)
+        elif self.mode == 'sleep':
+            self._sleep_until(deadline_ns)
+            return
+        else:
+            target = deadline_ns - self.margin.margin_ns
+            if target > now:
+                self._sleep_until(target)
+                self.margin.observe(perf_counter_ns() - target)
+        while perf_counter_ns() < deadline_ns:
+            pass
+
+def apply_realtime_settings(rt_priority=None, cpu=None):
+    """Requests SCHED_FIFO and/or pins the calling process to one core. Linux only."""
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+            logging.info(f"Clock process pinned to CPU {cpu}.")
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Could not pin clock process to CPU {cpu}: {e}")
+    if rt_priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(rt_priority))
+            logging.info(f"Clock process running SCHED_FIFO priority {rt_priority}.")
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Could not set SCHED_FIFO priority {rt_priority} (check LimitRTPRIO): {e}")
+
 class MidiClockGen:
-    def __init__(self):
-        self.shared_bpm = Value('i', 120)
-        self._run_code = Value('i', 1)
-        self.pulse_rate = Value('d', 60.0 / (self.shared_bpm.value * 24))
-        self.clock_running = Value('i', 1)
+    def __init__(self, timing_mode='hybrid', rt_priority=None, cpu=None, tempo_align='none', transport=False,
+                 follow=False, stats_name=STATS_NAME, late_threshold_us=DEFAULT_LATE_THRESHOLD_US):
+        self.timing_mode = timing_mode
+        self.rt_priority = rt_priority
+        self.cpu = cpu
+        self.tempo_align = tempo_align
+        self.transport = transport
+        self.follow = follow
+        self.tempo = TempoState.create(bpm=120)
+        self.stats = ClockStats.create(stats_name)
+        self.late_threshold_ns = late_threshold_us * 1000
+        # Set by the generator once its outputs are open
+        self.ready = Event()
         self.midi_process = None
 
-    def update_pulse_rate(self):
-        self.pulse_rate.value = 60.0 / (self.shared_bpm.value * 24)
-
     @staticmethod
-    def _midi_clock_generator(out_port_name, pulse_rate, run, clock_running):
+    def _midi_clock_generator(outputs, tempo, timing_mode='hybrid', rt_priority=None, cpu=None,
+                              tempo_align='none', transport=False, follow=False, stats=None,
+                              late_threshold_ns=DEFAULT_LATE_THRESHOLD_US * 1000, ready=None):
         try:
+            apply_realtime_settings(rt_priority, cpu)
+            waiter = TickWaiter(timing_mode)
+            logging.debug(f"Clock timing mode: {timing_mode}")
+
             # Cross-platform port handling
             if sys.platform == 'win32':
-                midi_output = mido.open_output(out_port_name)
+                midi_output = ClockOutputs(outputs, mido.open_output)
             else:
-                midi_output = mido.open_output(out_port_name, virtual=True, client_name='em_clock_out')
+                midi_output = ClockOutputs(outputs, lambda name: mido.open_output(
+                    name, virtual=True, client_name=name))
+            logging.debug(f"Clock outputs (name, offset us): {outputs}")
+            trace('em_clock', 'outputs open')
+            if ready is not None:
+                ready.set()
 
             clock_tick = mido.Message('clock')
-            while run.value:
-                if clock_running.value:
-                    midi_output.send(clock_tick)
-                    t1 = perf_counter()
-                    sleep(pulse_rate.value * 0.8)
-                    t2 = perf_counter()
-                    while (t2 - t1) < pulse_rate.value:
-                        t2 = perf_counter()
+            align_ticks = TEMPO_ALIGN_TICKS[tempo_align]
+            scheduler = None
+            ramp = None
+            tempo_id = None
+            follow_anchor = None
+            follow_emitted = 0
+            song_tick = 0
+            tempo.publish_position(song_tick)
+            # Only explicit start/continue/stop commands are echoed as transport
+            # messages; the free-running clock at launch sends none.
+            transport_id = tempo.snapshot().transport_id
+            last_report_ns = perf_counter_ns()
+            ticks_sent = 0
+            late_ticks = 0
+            worst_late_ns = 0
+
+            def publish_stats(running):
+                if stats is None:
+                    return
+                drift_ns = mean_drift_ns = resyncs = 0
+                bpm = tempo.snapshot().bpm
+                if scheduler is not None:
+                    bpm = bpm_for_period_ns(scheduler.period_ns)
+                    drift_ns = scheduler.drift_ns
+                    resyncs = scheduler.resyncs
+                    if scheduler.ticks_sent:
+                        mean_drift_ns = scheduler.drift_total_ns // scheduler.ticks_sent
+                stats.publish(ClockStatsSnapshot(
+                    pid=os.getpid(), updated_ns=time_ns(), bpm=bpm, running=running, song_tick=song_tick,
+                    ticks_sent=ticks_sent, late_ticks=late_ticks, late_threshold_ns=late_threshold_ns,
+                    worst_late_ns=worst_late_ns, drift_ns=drift_ns, mean_drift_ns=mean_drift_ns,
+                    resyncs=resyncs, cpu_ns=process_time_ns()))
+
+            publish_stats(0)
+            while True:
+                # One lock-free read per tick gives a consistent bpm/period/run view.
+                state = tempo.snapshot()
+                if not state.run:
+                    break
+                if state.running:
+                    if scheduler is None or state.transport_id != transport_id:
+                        if follow and state.follow_tick == 0:
+                            # Slaved: the first upstream pulse starts our timeline.
+                            tempo.wait_for(lambda s: s.follow_tick > 0 or not s.running or not s.run)
+                            continue
+                        if state.resume:
+                            if state.seek_tick >= 0:
+                                song_tick = state.seek_tick
+                            # Continue on the next sixteenth so the position fits in an SPP.
+                            spp = min(SPP_MAX, -(-song_tick // TICKS_PER_SIXTEENTH))
+                            song_tick = spp * TICKS_PER_SIXTEENTH
+                        else:
+                            spp = None
+                            song_tick = 0
+                        tempo.publish_position(song_tick)
+                        # Followed transport is always passed on; Pd's CC 41 only with transport on
+                        if (transport or follow) and state.transport_id != transport_id:
+                            if spp is None:
+                                midi_output.send_now(mido.Message('start'))
+                                logging.debug("Sent MIDI Start")
+                            else:
+                                midi_output.send_now(mido.Message('songpos', pos=spp))
+                                midi_output.send_now(mido.Message('continue'))
+                                logging.debug(f"Sent SPP {spp} and MIDI Continue")
+                        transport_id = state.transport_id
+                        if scheduler is None:
+                            # Start far enough ahead that outputs with negative offsets aren't late.
+                            scheduler = DeadlineScheduler(state.period_ns, perf_counter_ns() + midi_output.lead_ns)
+                        # Any ramp in progress when stopped resumes at its target.
+                        tempo_id = state.tempo_id
+                        ramp = None
+                        follow_anchor = None
+                        follow_emitted = 0
+                    if follow:
+                        if state.follow_anchor_ns != follow_anchor:
+                            # Re-derive our next deadline from the PLL's prediction for the
+                            # matching upstream pulse.
+                            follow_anchor = state.follow_anchor_ns
+                            target = (follow_anchor + midi_output.lead_ns
+                                      + (follow_emitted - state.follow_tick) * state.period_ns)
+                            if target < perf_counter_ns() - state.period_ns:
+                                # Fell over a pulse behind upstream; drop the backlog.
+                                scheduler.resyncs += 1
+                                follow_emitted = state.follow_tick
+                                target = follow_anchor + midi_output.lead_ns
+                            scheduler.reanchor(state.period_ns, target)
+                    elif state.tempo_id != tempo_id and (not align_ticks or song_tick % align_ticks == 0):
+                        # With alignment on, the boundary tick keeps its old deadline and
+                        # the new tempo starts from it, so the change is phase-aligned.
+                        tempo_id = state.tempo_id
+                        if state.ramp_ticks:
+                            ramp = TempoRamp(bpm_for_period_ns(scheduler.period_ns), state.bpm, state.ramp_ticks)
+                        else:
+                            ramp = None
+                            scheduler.set_period(state.period_ns)
+                    if ramp is not None:
+                        scheduler.set_period(ramp.next_period_ns())
+                        if ramp.done:
+                            ramp = None
+                    deadline = scheduler.next_deadline()
+                    late_ns = midi_output.send_at(clock_tick, deadline, waiter)
+                    now = perf_counter_ns()
+                    scheduler.tick_sent(deadline + late_ns)
+                    song_tick += 1
+                    follow_emitted += 1
+                    tempo.publish_position(song_tick)
+                    ticks_sent += 1
+                    if late_ns > late_threshold_ns:
+                        late_ticks += 1
+                    worst_late_ns = max(worst_late_ns, late_ns)
+                    if song_tick % PPQN == 0:
+                        # Once a beat is plenty for a status readout.
+                        publish_stats(1)
+                    if now - last_report_ns >= DRIFT_REPORT_INTERVAL_NS:
+                        logging.debug(f"Clock timing: {scheduler.drift_report()}")
+                        last_report_ns = now
                 else:
-                    sleep(0.1)
+                    if scheduler is not None:
+                        if (transport or follow) and state.transport_id != transport_id:
+                            midi_output.send_now(mido.Message('stop'))
+                            logging.debug(f"Sent MIDI Stop at tick {song_tick}")
+                        transport_id = state.transport_id
+                        # Restart the timeline from scratch on the next start.
+                        logging.debug(f"Clock stopped: {scheduler.drift_report()}")
+                        publish_stats(0)
+                        scheduler = None
+                    tempo.wait_for(lambda s: s.running or not s.run)
+            midi_output.close()
         except Exception as e:
             logging.error(f"Error in MIDI clock generator: {e}")
 
-    def launch_process(self, out_port_name):
+    def launch_process(self, outputs):
         if self.midi_process:
             self.end_process()
-        self._run_code.value = 1
-        self.clock_running.value = 1
+        if isinstance(outputs, str):
+            outputs = [(outputs, 0)]
+        # A slaved clock stays silent until the upstream clock arrives.
+        self.tempo.write(run=1, running=0 if self.follow else 1, follow_tick=0)
+        self.ready.clear()
         self.midi_process = Process(target=self._midi_clock_generator,
-                                    args=(out_port_name, self.pulse_rate, self._run_code, self.clock_running))
+                                    args=(outputs, self.tempo,
+                                          self.timing_mode, self.rt_priority, self.cpu, self.tempo_align,
+                                          self.transport, self.follow, self.stats, self.late_threshold_ns,
+                                          self.ready))
         self.midi_process.start()
+        if self.cpu is not None:
+            # The tempo writers (this process and the listener it starts next) stay off the tick core,
+            # so a writer preempted mid-write can't leave the realtime reader waiting on it.
+            try:
+                others = os.sched_getaffinity(0) - {self.cpu}
+                if others:
+                    os.sched_setaffinity(0, others)
+            except (AttributeError, OSError) as e:
+                logging.warning(f"Could not keep clock writers off CPU {self.cpu}: {e}")
 
     def end_process(self):
         if self.midi_process is not None:
-            self._run_code.value = 0
+            self.tempo.set_run(False)
             self.midi_process.join()
             self.midi_process = None
 
-def midi_bpm_listener(shared_bpm, run_code, clock_running, pulse_rate, in_port_name, cc_bpm=40, cc_start_stop=41):
+    def release(self):
+        self.tempo.close()
+        self.tempo.unlink()
+        self.stats.close()
+        self.stats.unlink()
+
+def midi_bpm_listener(tempo, in_port_name, cc_bpm=40, cc_start_stop=41):
+    def handle_message(msg):
+        # Runs on the MIDI backend's input thread as soon as a message arrives.
+        if msg.type == 'control_change':
+            if msg.control == cc_bpm:
+                new_bpm = cc_to_bpm(msg.value)
+                # bpm and period land in the same seqlocked write.
+                tempo.set_bpm(new_bpm)
+                logging.debug(f"set bpm: {new_bpm}")
+            elif msg.control == cc_start_stop:
+                is_running = msg.value >= CC_RUN_THRESHOLD
+                resume = is_running and msg.value < CC_START_VALUE
+                tempo.set_running(is_running, resume=resume)
+                if resume:
+                    logging.debug(f"Clock CONTINUE received (CC {cc_start_stop} value: {msg.value})")
+                elif is_running:
+                    logging.debug(f"Clock START received (CC {cc_start_stop} value: {msg.value})")
+                else:
+                    logging.debug(f"Clock STOP received (CC {cc_start_stop} value: {msg.value})")
+        elif msg.type == 'sysex':
+            parsed = parse_tempo_sysex(msg.data)
+            if parsed is None:
+                return
+            new_bpm, ramp_beats = parsed
+            new_bpm = min(BPM_MAX, max(BPM_MIN, new_bpm))
+            tempo.set_bpm(new_bpm, ramp_ticks=ramp_beats * PPQN)
+            if ramp_beats:
+                logging.debug(f"ramp bpm to {new_bpm:.2f} over {ramp_beats} beats")
+            else:
+                logging.debug(f"set bpm: {new_bpm:.2f}")
+
     try:
         # Cross-platform port handling
         if sys.platform == 'win32':
-            midi_input = mido.open_input(in_port_name)
+            midi_input = mido.open_input(in_port_name, callback=handle_message)
         else:
-            midi_input = mido.open_input(in_port_name, virtual=True, client_name='em_clock_in')
-
-        while run_code.value:
-            for msg in midi_input.iter_pending():
-                if msg.type == 'control_change':
-                    if msg.control == cc_bpm:
-                        new_bpm = int(30 + (msg.value * (300 - 30) / 127))
-                        shared_bpm.value = new_bpm
-                        pulse_rate.value = 60.0 / (new_bpm * 24)
-                        logging.debug(f"set bpm: {new_bpm}")
-                    elif msg.control == cc_start_stop:
-                        is_running = msg.value >= 64
-                        clock_running.value = 1 if is_running else 0
-                        if is_running:
-                            logging.debug(f"Clock START received (CC {cc_start_stop} value: {msg.value})")
-                        else:
-                            logging.debug(f"Clock STOP received (CC {cc_start_stop} value: {msg.value})")
-            sleep(0.1)
+            midi_input = mido.open_input(in_port_name, virtual=True, client_name='em_clock_in',
+                                         callback=handle_message)
+
+        tempo.wait_for(lambda s: not s.run)
+        midi_input.close()
     except Exception as e:
         logging.error(f"Error in MIDI BPM listener: {e}")
 
+FOLLOW_TIMEOUT_TICKS = 8
+FOLLOW_TIMEOUT_MIN_NS = 250_000_000
+
+def midi_clock_follower(tempo, in_port_name):
+    """Slave mode input: tracks an upstream MIDI clock and its transport into the tempo block."""
+    pll = ClockFollower(tempo.snapshot().period_ns)
+    lock = threading.Lock()
+    follow = {'ticks': 0, 'last_ns': None, 'stopped': False, 'seek_tick': -1}
+
+    def handle_message(msg):
+        now = perf_counter_ns()
+        with lock:
+            if msg.type == 'clock':
+                if follow['last_ns'] is None:
+                    pll.reset()
+                # Keep tracking while stopped so a later Start is already locked.
+                next_ns = pll.update(now)
+                follow['last_ns'] = now
+                if follow['stopped']:
+                    return
+                follow['ticks'] += 1
+                fields = dict(follow_anchor_ns=round(next_ns), follow_tick=follow['ticks'],
+                              period_ns=round(pll.period_ns), bpm=bpm_for_period_ns(pll.period_ns))
+                if follow['ticks'] == 1 and not tempo.snapshot().running:
+                    # Upstream clock (re)appeared without a Start: free-run from the top.
+                    fields.update(running=1, resume=0)
+                tempo.write(**fields)
+            elif msg.type == 'start':
+                follow.update(ticks=0, stopped=False, seek_tick=-1)
+                tempo.set_running(True, follow_tick=0)
+                logging.debug("Upstream START received")
+            elif msg.type == 'continue':
+                tempo.set_running(True, resume=True, seek_tick=follow['seek_tick'], follow_tick=0)
+                follow.update(ticks=0, stopped=False, seek_tick=-1)
+                logging.debug("Upstream CONTINUE received")
+            elif msg.type == 'stop':
+                follow['stopped'] = True
+                tempo.set_running(False)
+                logging.debug("Upstream STOP received")
+            elif msg.type == 'songpos':
+                follow['seek_tick'] = msg.pos * TICKS_PER_SIXTEENTH
+                logging.debug(f"Upstream SPP {msg.pos} received")
+
+    try:
+        # Use an existing port if one matches, otherwise publish a virtual one to route into.
+        port_name = next((p for p in mido.get_input_names() if in_port_name.lower() in p.lower()), None)
+        if port_name or sys.platform == 'win32':
+            midi_input = mido.open_input(port_name or in_port_name, callback=handle_message)
+        else:
+            midi_input = mido.open_input(in_port_name, virtual=True, client_name=in_port_name,
+                                         callback=handle_message)
+        logging.info(f"Following MIDI clock from '{midi_input.name}'")
+
+        while True:
+            state = tempo.wait_for(lambda s: not s.run, timeout=0.05)
+            if not state.run:
+                break
+            with lock:
+                last_ns = follow['last_ns']
+                timeout_ns = max(FOLLOW_TIMEOUT_MIN_NS, FOLLOW_TIMEOUT_TICKS * pll.period_ns)
+                if last_ns is not None and perf_counter_ns() - last_ns > timeout_ns:
+                    # Upstream clock vanished without a Stop: go quiet, but send no
+                    # transport message since upstream never asked for one.
+                    follow.update(ticks=0, last_ns=None)
+                    if not follow['stopped']:
+                        tempo.write(running=0, follow_tick=0)
+                        logging.warning("Upstream MIDI clock lost.")
+        midi_input.close()
+    except Exception as e:
+        logging.error(f"Error in MIDI clock follower: {e}")
+
 class MidiClockApp:
-    def __init__(self):
-        self.mcg = MidiClockGen()
+    def __init__(self, timing_mode='hybrid', rt_priority=None, cpu=None, tempo_align='none', transport=False,
+                 outputs=None, follow_port=None, late_threshold_us=DEFAULT_LATE_THRESHOLD_US):
+        self.mcg = MidiClockGen(timing_mode, rt_priority, cpu, tempo_align, transport, follow=bool(follow_port),
+                                late_threshold_us=late_threshold_us)
+        self.outputs = outputs or DEFAULT_OUTPUTS
+        self.follow_port = follow_port
 
     def clean_exit(self):
         if self.mcg.midi_process:
             self.mcg.end_process()
+        self.mcg.release()
 
     def start(self):
         # Platform-specific port configuration
@@ -101,20 +650,31 @@ class MidiClockApp:
             
             if not virtual_in_port or not virtual_out_port:
                 raise RuntimeError("Couldn't find 'em_clock' loopMIDI port(s).")
+            outputs = [(virtual_out_port, 0)] if self.outputs == DEFAULT_OUTPUTS else self.outputs
         else:
             # Linux/macOS configuration
             virtual_in_port = "em_clock_in"
-            virtual_out_port = "em_clock_out"
+            outputs = self.outputs
 
         try:
-            logging.debug(f"Using MIDI ports: In='{virtual_in_port}', Out='{virtual_out_port}'")
-            self.mcg.launch_process(virtual_out_port)
+            logging.debug(f"Using MIDI ports: In='{virtual_in_port}', Out={outputs}")
+            self.mcg.launch_process(outputs)
 
-            midi_listener_process = Process(target=midi_bpm_listener, args=(
-                self.mcg.shared_bpm, self.mcg._run_code, self.mcg.clock_running, 
-                self.mcg.pulse_rate, virtual_in_port))
+            if self.follow_port:
+                # Slaved to an external clock: tempo and transport come from upstream, not Pd's CCs.
+                midi_listener_process = Process(target=midi_clock_follower, args=(
+                    self.mcg.tempo, self.follow_port))
+            else:
+                midi_listener_process = Process(target=midi_bpm_listener, args=(
+                    self.mcg.tempo, virtual_in_port))
             midi_listener_process.start()
 
+            if not self.mcg.ready.wait(READY_TIMEOUT):
+                # Exit so the service manager restarts us rather than idling without a clock.
+                logging.error(f"Clock outputs did not open within {READY_TIMEOUT}s.")
+                return
+            trace('em_clock', 'ready')
+            notify_ready()
             logging.info("MIDI clock is running. Press Ctrl+C to stop.")
             while True:
                 sleep(1)
@@ -124,7 +684,180 @@ class MidiClockApp:
             self.clean_exit()
             logging.info("MIDI clock stopped.")
 
+BENCH_PORT_NAME = "em_clock_bench"
+BENCH_DEFAULT_BPMS = list(range(30, 301, 30))
+
+def _percentile(sorted_values, pct):
+    # Nearest-rank percentile on an already sorted list.
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def summarise_ticks(timestamps_ns, period_ns):
+    """Timing stats (in microseconds) for received clock timestamps against the nominal period."""
+    intervals = [b - a for a, b in zip(timestamps_ns, timestamps_ns[1:])]
+    if not intervals:
+        return {'ticks': len(timestamps_ns)}
+    jitter = sorted(abs(i - period_ns) for i in intervals)
+    drift_ns = (timestamps_ns[-1] - timestamps_ns[0]) - len(intervals) * period_ns
+    return {
+        'ticks': len(timestamps_ns),
+        'period_us': period_ns / 1000,
+        'mean_period_error_us': round((sum(intervals) / len(intervals) - period_ns) / 1000, 3),
+        'jitter_p50_us': round(_percentile(jitter, 50) / 1000, 3),
+        'jitter_p99_us': round(_percentile(jitter, 99) / 1000, 3),
+        'jitter_max_us': round(jitter[-1] / 1000, 3),
+        'drift_us': round(drift_ns / 1000, 3),
+    }
+
+def _open_bench_input(port_name, callback, timeout=5.0):
+    # The generator process creates the virtual port; wait for it to show up.
+    waited = 0.0
+    while waited < timeout:
+        name = next((p for p in mido.get_input_names() if port_name in p), None)
+        if name:
+            return mido.open_input(name, callback=callback)
+        sleep(0.1)
+        waited += 0.1
+    raise RuntimeError(f"Clock bench port '{port_name}' did not appear within {timeout}s.")
+
+def run_bench(bpms, duration, timing_mode='hybrid', rt_priority=None, cpu=None, out=sys.stdout):
+    """Runs the generator into a virtual loopback port and writes one JSON line per BPM."""
+    if sys.platform == 'win32':
+        raise RuntimeError("Clock bench needs virtual MIDI ports (Linux/macOS).")
+
+    timestamps = []
+    collecting = threading.Event()
+
+    def on_message(msg):
+        if msg.type == 'clock' and collecting.is_set():
+            timestamps.append(perf_counter_ns())
+
+    # Stats go to a private block so a bench doesn't clobber a running clock's.
+    mcg = MidiClockGen(timing_mode, rt_priority, cpu, stats_name=None)
+    mcg.launch_process(BENCH_PORT_NAME)
+    bench_input = None
+    try:
+        bench_input = _open_bench_input(BENCH_PORT_NAME, on_message)
+        for bpm in bpms:
+            period_ns = mcg.tempo.set_bpm(bpm).period_ns
+            # Let the tempo change land before measuring.
+            sleep(period_ns * 24 / 1e9)
+            timestamps.clear()
+            collecting.set()
+            sleep(duration)
+            collecting.clear()
+            result = {
+                'bpm': bpm,
+                'timing': timing_mode,
+                'rt_priority': rt_priority,
+                'cpu': cpu,
+                'duration_s': duration,
+                'host': platform.node(),
+            }
+            result.update(summarise_ticks(list(timestamps), period_ns))
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            logging.info(f"Bench {bpm} BPM: {result}")
+    finally:
+        if bench_input:
+            bench_input.close()
+        mcg.end_process()
+        mcg.release()
+
+def read_status(stats_name=STATS_NAME):
+    """Current generator telemetry as a JSON-friendly dict."""
+    stats = ClockStats.attach(stats_name)
+    try:
+        snapshot = stats.snapshot()
+    finally:
+        stats.close()
+    return {
+        'pid': snapshot.pid,
+        'age_s': round((time_ns() - snapshot.updated_ns) / 1e9, 3),
+        'bpm': round(snapshot.bpm, 3),
+        'running': bool(snapshot.running),
+        'song_tick': snapshot.song_tick,
+        'ticks_sent': snapshot.ticks_sent,
+        'late_ticks': snapshot.late_ticks,
+        'late_threshold_us': snapshot.late_threshold_ns / 1000,
+        'worst_late_us': round(snapshot.worst_late_ns / 1000, 1),
+        'drift_us': round(snapshot.drift_ns / 1000, 1),
+        'mean_drift_us': round(snapshot.mean_drift_ns / 1000, 1),
+        'resyncs': snapshot.resyncs,
+        'cpu_s': round(snapshot.cpu_ns / 1e9, 3),
+    }
+
+def print_status(watch=None, out=sys.stdout):
+    while True:
+        try:
+            out.write(json.dumps(read_status()) + "\n")
+        except FileNotFoundError:
+            out.write(json.dumps({'error': "em_clock is not running"}) + "\n")
+            if not watch:
+                return 1
+        out.flush()
+        if not watch:
+            return 0
+        sleep(watch)
+
+def add_clock_arguments(parser):
+    """The clock generator's options, shared with em_services so the unified daemon keeps them all."""
+    parser.add_argument('--timing', choices=TIMING_MODES, default='hybrid',
+                        help="tick wait strategy (default: hybrid)")
+    parser.add_argument('--rt-priority', type=int, metavar='PRIO',
+                        help="run the tick process as SCHED_FIFO with this priority (1-99)")
+    parser.add_argument('--cpu', type=int, metavar='N',
+                        help="pin the tick process to this CPU core")
+    parser.add_argument('--tempo-align', choices=TEMPO_ALIGN_TICKS, default='none',
+                        help="apply tempo changes immediately or on the next beat/bar (default: none)")
+    parser.add_argument('--transport', action='store_true',
+                        help="send MIDI Start/Continue/Stop/SPP on CC 41 transport changes (off by default: "
+                             "Pd still sends its own Start/Stop through pisound)")
+    parser.add_argument('--output', dest='outputs', action='append', type=parse_output_spec,
+                        metavar='NAME[:OFFSET_US]',
+                        help="clock output port with a signed latency offset in microseconds; "
+                             "repeat for several outputs (default: em_clock_out:0)")
+    parser.add_argument('--follow', metavar='PORT',
+                        help="slave to the MIDI clock arriving on PORT (an existing input port, "
+                             "or a virtual port of that name to route into) instead of being master")
+    parser.add_argument('--late-threshold-us', type=int, default=DEFAULT_LATE_THRESHOLD_US, metavar='US',
+                        help="count ticks sent later than this as late in the status telemetry "
+                             f"(default: {DEFAULT_LATE_THRESHOLD_US})")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="emsys realtime MIDI clock")
+    add_clock_arguments(parser)
+    subparsers = parser.add_subparsers(dest='command')
+    bench = subparsers.add_parser('bench', help="measure clock jitter and drift over a virtual loopback port")
+    bench.add_argument('--bpm', type=lambda v: [int(b) for b in v.split(',')], default=BENCH_DEFAULT_BPMS,
+                       help="comma-separated BPMs to measure (default: 30,60,...,300)")
+    bench.add_argument('--duration', type=float, default=10.0,
+                       help="seconds to measure per BPM (default: 10)")
+    bench.add_argument('--output', help="write JSON lines to this file instead of stdout")
+    status = subparsers.add_parser('status', help="print the running clock's telemetry as JSON")
+    status.add_argument('--watch', type=float, metavar='SECONDS',
+                        help="keep printing a line every SECONDS")
+    return parser.parse_args(argv)
+
 if __name__ == '__main__':
     freeze_support()
-    app = MidiClockApp()
-    app.start()
\ No newline at end of file
+    args = parse_args()
+    if args.command == 'bench':
+        bench_out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            run_bench(args.bpm, args.duration, args.timing, args.rt_priority, args.cpu, bench_out)
+        finally:
+            if args.output:
+                bench_out.close()
+    elif args.command == 'status':
+        try:
+            sys.exit(print_status(args.watch))
+        except KeyboardInterrupt:
+            pass
+    else:
+        trace('em_clock', 'start')
+        app = MidiClockApp(args.timing, args.rt_priority, args.cpu, args.tempo_align, args.transport,
+                           args.outputs, args.follow, args.late_threshold_us)
+        app.start()
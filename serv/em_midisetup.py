@@ -1,131 +1,428 @@
-import subprocess
+import argparse
+import json
+import math
+import os
+import select
+import tempfile
 import time
+from collections import Counter, deque, namedtuple
 
-# Function to get the client number by name using aconnect
-def get_client_number_cache(client_name, input=True):
-    command = ['aconnect', '-i'] if input else ['aconnect', '-o']
-    result = subprocess.run(command, capture_output=True, text=True)
-    lines = result.stdout.splitlines()
-
-    client_num = None
-    for line in lines:
-        if client_name.lower() in line.lower() and "client" in line:
-            client_num = line.split()[1].strip(':')
-            break
-    return client_num
-
-# Function to get all current connections using aconnect -l
-def get_all_connections():
-    result = subprocess.run(['aconnect', '-l'], capture_output=True, text=True)
-    return result.stdout
-
-# Function to check and connect ports if not already connected
-def connect_ports(connections, src_client, src_port, dest_client, dest_port):
-    if f'{src_client}:{src_port}' in connections and f'{dest_client}:{dest_port}' in connections:
-        print(f"{src_client}:{src_port} is already connected to {dest_client}:{dest_port}")
-    else:
-        subprocess.run(['aconnect', f'{src_client}:{src_port}', f'{dest_client}:{dest_port}'])
-        print(f"Connected {src_client}:{src_port} to {dest_client}:{dest_port}")
-
-while True:
-    # Cache all client numbers
-    client_cache = {
-        "CLK_OUT_CLIENT": get_client_number_cache("em_clock_out", input=True),
-        "CLK_IN_CLIENT": get_client_number_cache("em_clock_in", input=False),
-        "PS_CLIENT": get_client_number_cache("pisound"),
-        "MCL_CLIENT": get_client_number_cache("MegaCMD"),
-        "ML3_CLIENT": get_client_number_cache("Minilab3"),
-        "PD_CLIENT": get_client_number_cache("Pure Data")
-    }
-
-    # Log the found client numbers
-    for client_name, client_num in client_cache.items():
-        print(f"{client_name}: {client_num}")
-
-    # Hardcoded port numbers - assumes we have Pd ports set to 4/4
-    CLK_OUT, CLK_IN, PS_OUT, PS_IN, ML3_OUT, ML3_IN, MCL_OUT, MCL_IN = 0, 0, 0, 0, 0, 0, 0, 0
-    PD_IN_1, PD_IN_2, PD_IN_3, PD_IN_4, PD_OUT_1, PD_OUT_2, PD_OUT_3, PD_OUT_4 = 0, 1, 2, 3, 4, 5, 6, 7
-
-    # Get all current connections once per loop
-    connections = get_all_connections()
-
-    # Try connecting ports, reusing client_cache and connections
-    missing_clients = []
-
-    # Pd 1 to Clock In (bpm ctl)
-    if client_cache["PD_CLIENT"] and client_cache["CLK_IN_CLIENT"]:
-        connect_ports(connections, client_cache["PD_CLIENT"], PD_OUT_1, client_cache["CLK_IN_CLIENT"], CLK_IN)
-    else:
-        missing_clients.append("Pure Data to Clock In")
-
-    # Pd 2 to Pisound (synth ctl)
-    if client_cache["PD_CLIENT"] and client_cache["PS_CLIENT"]:
-        connect_ports(connections, client_cache["PD_CLIENT"], PD_OUT_2, client_cache["PS_CLIENT"], PS_IN)
-    else:
-        missing_clients.append("Pure Data to Pisound")
-
-    # Pd 3 to Minilab3 (sysex UI)
-    if client_cache["PD_CLIENT"] and client_cache["ML3_CLIENT"]:
-        connect_ports(connections, client_cache["PD_CLIENT"], PD_OUT_3, client_cache["ML3_CLIENT"], ML3_IN)
-    else:
-        missing_clients.append("Pure Data to Minilab3")
-
-    # Clock Out to Pd 1 (bpm feedback)
-    if client_cache["CLK_OUT_CLIENT"] and client_cache["PD_CLIENT"]:
-        connect_ports(connections, client_cache["CLK_OUT_CLIENT"], CLK_OUT, client_cache["PD_CLIENT"], PD_IN_1)
-    else:
-        missing_clients.append("Clock Out to Pure Data")
-
-    # Clock Out to Pisound (external hardware)
-    if client_cache["CLK_OUT_CLIENT"] and client_cache["PS_CLIENT"]:
-        connect_ports(connections, client_cache["CLK_OUT_CLIENT"], CLK_OUT, client_cache["PS_CLIENT"], PS_IN)
-    else:
-        missing_clients.append("Clock Out to Pisound")
-
-    # Clock Out to MCL via USB
-    if client_cache["CLK_OUT_CLIENT"] and client_cache["MCL_CLIENT"]:
-        connect_ports(connections, client_cache["CLK_OUT_CLIENT"], CLK_OUT, client_cache["MCL_CLIENT"], MCL_IN)
-    else:
-        missing_clients.append("Clock Out to MCL USB")
-
-    # Pisound to Pd 2 (synth feedback)
-    if client_cache["PS_CLIENT"] and client_cache["PD_CLIENT"]:
-        connect_ports(connections, client_cache["PS_CLIENT"], PS_OUT, client_cache["PD_CLIENT"], PD_IN_2)
-    else:
-        missing_clients.append("Pisound to Pure Data")
-
-    # Minilab3 to Pd 3 (note/CC/transport ctl)
-    if client_cache["ML3_CLIENT"] and client_cache["PD_CLIENT"]:
-        connect_ports(connections, client_cache["ML3_CLIENT"], ML3_OUT, client_cache["PD_CLIENT"], PD_IN_3)
-    else:
-        missing_clients.append("Minilab3 to Pure Data")
-
-    # MCL to Pd 4 (external hardware - extra functionality)
-    if client_cache["MCL_CLIENT"] and client_cache["PD_CLIENT"]:
-        connect_ports(connections, client_cache["MCL_CLIENT"], MCL_OUT, client_cache["PD_CLIENT"], PD_IN_4)
-    else:
-        missing_clients.append("MCL to Pure Data")
-    
-    # MCL to Pd 4 (external hardware - extra functionality)
-    if client_cache["MCL_CLIENT"] and client_cache["PD_CLIENT"]:
-        connect_ports(connections, client_cache["PD_CLIENT"], PD_OUT_4, client_cache["MCL_CLIENT"], MCL_IN)
-    else:
-        missing_clients.append("Pure Data to MCL USB")
-    
-    if client_cache["PS_CLIENT"] and client_cache["MCL_CLIENT"]:
-        connect_ports(connections, client_cache["PS_CLIENT"], PS_OUT, client_cache["MCL_CLIENT"], MCL_IN)
-    else:
-        missing_clients.append("Pisound to MCL USB")
-
-    # Report missing clients
-    if missing_clients:
-        print("The following connections were not established due to missing clients:")
-        for client in missing_clients:
-            print(f"  - {client}")
-    else:
-        print("All clients connected successfully.")
-
-    print("====")
-    
-    # Wait before rechecking connections
-    time.sleep(5)
+from alsa_midi import (ALSAError, Address, ClientExitEvent, ClientStartEvent, ClockEvent, ContinueEvent,
+                       PortChangeEvent, PortExitEvent, PortStartEvent, PortType, PortUnsubscribedEvent,
+                       SequencerClient, StartEvent, StopEvent, SubscriptionQueryType, SYSTEM_ANNOUNCE, WRITE_PORT)
+
+from em_boot import notify_ready, trace
+
+SEQ_CLIENT_NAME = "em_midisetup"
+# A replugged device announces its client and ports as a burst; settle this long before routing
+DEBOUNCE_INTERVAL = 0.02
+
+# System:Announce events that can change which routes are possible (or drop one we made)
+TOPOLOGY_EVENTS = (ClientStartEvent, ClientExitEvent, PortStartEvent, PortExitEvent, PortChangeEvent,
+                   PortUnsubscribedEvent)
+
+SERV_DIR = os.path.dirname(os.path.abspath(__file__))
+ROUTES_FILE = os.path.join(SERV_DIR, "routes.conf")
+ROUTES_EXAMPLE_FILE = os.path.join(SERV_DIR, "routes.conf.example")
+
+# Monitor mode
+STATUS_FILE = os.path.join(tempfile.gettempdir(), "em_midisetup_status.json")
+STATUS_INTERVAL = 1.0
+HISTORY_LENGTH = 50
+# Alert when this route carries no clock for CLOCK_GAP_PULSES pulse periods while running
+CLOCK_ROUTE = ("em_clock_out", "MegaCMD")
+CLOCK_GAP_PULSES = 2
+
+Route = namedtuple('Route', 'src_client src_port dest_client dest_port description')
+
+# CLIENT[:PORT], where PORT is a port number or a port name
+def _parse_endpoint(text):
+    client, sep, port = text.rpartition(':')
+    if not sep:
+        client, port = text, '0'
+    client, port = client.strip(), port.strip()
+    if not client or not port:
+        raise ValueError(f"missing client or port name in '{text}'")
+    return client, int(port) if port.isdigit() else port
+
+def parse_routes(lines):
+    routes = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        src, arrow, dest = line.partition('->')
+        if not arrow:
+            raise ValueError(f"line {line_number}: expected 'source -> destination', got '{line}'")
+        try:
+            routes.append(Route(*_parse_endpoint(src), *_parse_endpoint(dest), description=line))
+        except ValueError as e:
+            raise ValueError(f"line {line_number}: {e}") from None
+    return routes
+
+# routes.conf if the user has one, otherwise the shipped example
+def load_routes():
+    path = ROUTES_FILE if os.path.exists(ROUTES_FILE) else ROUTES_EXAMPLE_FILE
+    with open(path) as f:
+        routes = parse_routes(f)
+    print(f"Loaded {len(routes)} routes from {path}")
+    return routes
+
+class PortIndex:
+    """Clients and ports from a single walk of the sequencer, resolvable by name.
+
+    Built once per topology change; each route is then a couple of dict
+    lookups. Names match case-insensitively, exact names first, then a
+    suffix match ("Midi-Out 1" finds "Pure Data Midi-Out 1" but not
+    "... Midi-Out 10"), then any substring.
+    """
+    def __init__(self, ports):
+        self.ports = ports
+        self.client_names = {}
+        self.client_ports = {}
+        for port in ports:
+            self.client_names[port.client_id] = port.client_name
+            self.client_ports.setdefault(port.client_id, []).append(port)
+        self._clients = {}
+
+    @classmethod
+    def scan(cls, seq):
+        # Pd registers its ports as APPLICATION only, so don't filter on MIDI_GENERIC.
+        return cls(seq.list_ports(type=PortType.ANY, sort=False))
+
+    @staticmethod
+    def _match(name, candidates):
+        key = name.lower()
+        for matches in (lambda n: n == key, lambda n: n.endswith(key), lambda n: key in n):
+            for candidate_id, candidate_name in candidates:
+                if matches(candidate_name.lower()):
+                    return candidate_id
+        return None
+
+    def client(self, name):
+        if name not in self._clients:
+            self._clients[name] = self._match(name, self.client_names.items())
+        return self._clients[name]
+
+    def address(self, client_name, port):
+        client_id = self.client(client_name)
+        if client_id is None:
+            return None
+        if isinstance(port, int):
+            return Address(client_id, port)
+        port_id = self._match(port, [(p.port_id, p.name) for p in self.client_ports[client_id]])
+        return None if port_id is None else Address(client_id, port_id)
+
+def desired_subscriptions(routes, index):
+    desired = {}
+    missing_routes = []
+    for route in routes:
+        src = index.address(route.src_client, route.src_port)
+        dest = index.address(route.dest_client, route.dest_port)
+        if src is None or dest is None:
+            missing_routes.append(route.description)
+            continue
+        desired[(src, dest)] = route
+    return desired, missing_routes
+
+# Every subscription whose two ends are both clients the route table manages
+def actual_subscriptions(seq, ports, managed):
+    actual = set()
+    for port in ports:
+        if port.client_id not in managed:
+            continue
+        src = Address(port.client_id, port.port_id)
+        for sub in seq.list_port_subscribers(src, SubscriptionQueryType.READ):
+            if sub.addr.client_id in managed:
+                actual.add((src, Address(*sub.addr)))
+    return actual
+
+def sync_routes(seq, routes):
+    index = PortIndex.scan(seq)
+    names = dict.fromkeys(name for route in routes for name in (route.src_client, route.dest_client))
+    clients = {name: index.client(name) for name in names}
+    desired, missing_routes = desired_subscriptions(routes, index)
+    managed = {client_id for client_id in clients.values() if client_id is not None}
+    actual = actual_subscriptions(seq, index.ports, managed)
+
+    # Apply only the difference: drop stale routes first, then add the missing ones
+    for src, dest in actual - desired.keys():
+        try:
+            seq.unsubscribe_port(src, dest)
+            print(f"Disconnected stale route {src.client_id}:{src.port_id} -> {dest.client_id}:{dest.port_id}")
+        except ALSAError as e:
+            print(f"Failed to disconnect {src.client_id}:{src.port_id} -> {dest.client_id}:{dest.port_id}: {e}")
+    connected = {pair: route for pair, route in desired.items() if pair in actual}
+    for src, dest in desired.keys() - actual:
+        route = desired[(src, dest)]
+        try:
+            seq.subscribe_port(src, dest)
+            print(f"Connected {src.client_id}:{src.port_id} -> {dest.client_id}:{dest.port_id} "
+                  f"({route.description})")
+            connected[(src, dest)] = route
+        except ALSAError as e:
+            print(f"Failed to connect {route.description}: {e}")
+    return clients, connected, missing_routes
+
+class RouteMonitor:
+    """Per-route traffic and health, written periodically to a JSON status file.
+
+    Every routed source port is also subscribed to a monitor port of our own,
+    so ALSA hands us a copy of each event the route carries. Events are only
+    counted here; rates, the clock gap check and the status file are updated
+    on a timer.
+    """
+    def __init__(self, seq, status_file=STATUS_FILE):
+        self.seq = seq
+        self.port = seq.create_port("monitor", WRITE_PORT)
+        self.address = Address(seq.client_id, self.port.port_id)
+        self.status_file = status_file
+        self.routes = []
+        self.connected = {}
+        self.taps = set()
+        self.counts = Counter()
+        self.rates = {}
+        self.history = deque(maxlen=HISTORY_LENGTH)
+        self.clock_pair = None
+        self.clock_running = False
+        self.clock_period = None
+        self.last_clock = None
+        self.clock_gap = False
+        self.last_status = time.monotonic()
+
+    def _record(self, route, state):
+        self.history.append({'time': round(time.time(), 3), 'route': route, 'state': state})
+        print(f"Route {state}: {route}")
+
+    def update(self, routes, connected):
+        """Called after every sync with the full table and the routes now connected."""
+        self.routes = routes
+        before = {route.description for route in self.connected.values()}
+        after = {route.description for route in connected.values()}
+        for description in after - before:
+            self._record(description, 'up')
+        for description in before - after:
+            self._record(description, 'down')
+        self.connected = connected
+
+        self.clock_pair = next((pair for pair, route in connected.items()
+                                if (route.src_client.lower(), route.dest_client.lower())
+                                == tuple(name.lower() for name in CLOCK_ROUTE)), None)
+        if self.clock_pair is None:
+            self.clock_gap = False
+            self.last_clock = None
+
+        sources = {src for src, _ in connected}
+        for src in self.taps - sources:
+            try:
+                self.seq.unsubscribe_port(src, self.address)
+            except ALSAError:
+                pass  # The source port is already gone
+        for src in sources - self.taps:
+            try:
+                self.seq.subscribe_port(src, self.address)
+            except ALSAError as e:
+                print(f"Failed to monitor {src.client_id}:{src.port_id}: {e}")
+                sources.discard(src)
+        self.taps = sources
+
+    def observe(self, event):
+        if isinstance(event, PortUnsubscribedEvent):
+            pair = (Address(*event.connect_sender), Address(*event.connect_dest))
+            if pair in self.connected:
+                # Dropped behind our back; the sync that follows will show it back up.
+                self._record(self.connected.pop(pair).description, 'down')
+                if pair == self.clock_pair:
+                    self.clock_pair = None
+                    self.clock_gap = False
+            return
+        if event.source not in self.taps:
+            return
+        source = Address(*event.source)
+        self.counts[source] += 1
+        if self.clock_pair is None or source != self.clock_pair[0]:
+            return
+        if isinstance(event, ClockEvent):
+            now = time.monotonic()
+            if self.last_clock is not None and self.clock_running and not self.clock_gap:
+                interval = now - self.last_clock
+                self.clock_period = interval if self.clock_period is None else \
+                    0.9 * self.clock_period + 0.1 * interval
+            if self.clock_gap:
+                self.clock_gap = False
+                self._record(self.connected[self.clock_pair].description,
+                             f"clock resumed after {now - self.last_clock:.3f}s")
+            self.clock_running = True
+            self.last_clock = now
+        elif isinstance(event, (StartEvent, ContinueEvent)):
+            self.clock_running = True
+        elif isinstance(event, StopEvent):
+            # A deliberate stop isn't a gap
+            self.clock_running = False
+            self.clock_gap = False
+
+    def _clock_deadline(self):
+        if self.clock_running and not self.clock_gap and self.last_clock is not None and self.clock_period:
+            return self.last_clock + CLOCK_GAP_PULSES * self.clock_period
+        return None
+
+    def timeout(self):
+        """Seconds until poll() next has work to do."""
+        deadlines = [self.last_status + STATUS_INTERVAL]
+        clock_deadline = self._clock_deadline()
+        if clock_deadline is not None:
+            deadlines.append(clock_deadline)
+        return max(0, min(deadlines) - time.monotonic())
+
+    def poll(self):
+        now = time.monotonic()
+        clock_deadline = self._clock_deadline()
+        if clock_deadline is not None and now >= clock_deadline:
+            self.clock_gap = True
+            self._record(self.connected[self.clock_pair].description,
+                         f"clock gap (> {CLOCK_GAP_PULSES} pulses of {self.clock_period * 1000:.1f}ms)")
+        if now - self.last_status >= STATUS_INTERVAL:
+            elapsed = now - self.last_status
+            self.rates = {src: count / elapsed for src, count in self.counts.items()}
+            self.counts.clear()
+            self.last_status = now
+            self.write_status()
+
+    def status(self):
+        connected = {route.description: src for (src, _), route in self.connected.items()}
+        routes = [{
+            'route': route.description,
+            'up': route.description in connected,
+            'events_per_s': round(self.rates.get(connected.get(route.description), 0.0), 1),
+        } for route in self.routes]
+        alerts = [f"route down: {route['route']}" for route in routes if not route['up']]
+        if self.clock_gap:
+            alerts.append(f"clock gap: {self.connected[self.clock_pair].description}")
+        return {
+            'updated': round(time.time(), 3),
+            'routes': routes,
+            'clock': {
+                'route': self.connected[self.clock_pair].description if self.clock_pair else None,
+                'running': self.clock_running,
+                'period_ms': round(self.clock_period * 1000, 3) if self.clock_period else None,
+                'gap': self.clock_gap,
+            },
+            'alerts': alerts,
+            'history': list(self.history),
+        }
+
+    def write_status(self):
+        # Write-then-rename so readers never see a partial file
+        tmp_file = f"{self.status_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.status(), f)
+        os.replace(tmp_file, self.status_file)
+
+def event_input(seq, timeout=None, wakeup_fd=None, prefer_bytes=False):
+    """Next event from seq; None after timeout seconds or once wakeup_fd is readable.
+
+    Use instead of seq.event_input(timeout=...): alsa_midi 1.0.2 hands the
+    remaining seconds to poll(), which counts milliseconds, so its timed waits
+    spin rather than sleep. This polls the client's fd itself.
+    """
+    if not seq.event_input_pending():
+        poller = select.poll()
+        poller.register(seq._fd, select.POLLIN)
+        if wakeup_fd is not None:
+            poller.register(wakeup_fd, select.POLLIN)
+        ready = poller.poll(None if timeout is None else math.ceil(max(0, timeout) * 1000))
+        if not any(fd == seq._fd for fd, _ in ready):
+            return None
+    return seq.event_input(prefer_bytes=prefer_bytes)
+
+def _is_topology_change(seq, event):
+    # Our own monitor taps coming and going don't affect routing
+    if isinstance(event, PortUnsubscribedEvent) and event.connect_dest.client_id == seq.client_id:
+        return False
+    return isinstance(event, TOPOLOGY_EVENTS)
+
+def _next_event(seq, monitor, timeout=None):
+    if monitor is None:
+        return event_input(seq, timeout)
+    wait = monitor.timeout() if timeout is None else min(timeout, monitor.timeout())
+    event = event_input(seq, wait)
+    if event is not None:
+        monitor.observe(event)
+    monitor.poll()
+    return event
+
+# Block until the sequencer topology changes, then swallow the rest of the burst.
+# Without a monitor nothing runs in between; with one, it sees every event and wakes for its timers.
+def wait_for_topology_change(seq, monitor=None):
+    try:
+        while not _is_topology_change(seq, _next_event(seq, monitor)):
+            pass
+        settle_until = time.monotonic() + DEBOUNCE_INTERVAL
+        while (remaining := settle_until - time.monotonic()) > 0:
+            event = _next_event(seq, monitor, remaining)
+            if _is_topology_change(seq, event):
+                settle_until = time.monotonic() + DEBOUNCE_INTERVAL
+    except ALSAError as e:
+        # Most likely an input overrun, so announcements were lost: resync anyway.
+        print(f"Sequencer event error, resyncing: {e}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="emsys MIDI routing")
+    parser.add_argument('--monitor', action='store_true',
+                        help="track per-route event rates, route up/down history and clock gaps")
+    parser.add_argument('--status-file', default=STATUS_FILE,
+                        help=f"where --monitor writes its JSON status (default: {STATUS_FILE})")
+    return parser.parse_args(argv)
+
+def run(status_file=None, on_synced=None):
+    """Keeps the routes in sync until the process exits; monitors them if status_file is given.
+
+    on_synced() is called once, after the first sync has been applied.
+    """
+    routes = load_routes()
+    seq = SequencerClient(SEQ_CLIENT_NAME)
+    # Client/port start and exit notifications arrive here, so nothing runs while the setup is stable.
+    announce_port = seq.create_port("announce", WRITE_PORT)
+    announce_port.connect_from(SYSTEM_ANNOUNCE)
+    monitor = RouteMonitor(seq, status_file) if status_file else None
+    last_report = None
+    try:
+        while True:
+            clients, connected, missing_routes = sync_routes(seq, routes)
+            if monitor:
+                monitor.update(routes, connected)
+
+            # Only report when something changed
+            report = (clients, missing_routes)
+            if report != last_report:
+                for client_name, client_num in clients.items():
+                    print(f"{client_name}: {client_num}")
+                if missing_routes:
+                    print("The following connections were not established due to missing clients or ports:")
+                    for route in missing_routes:
+                        print(f"  - {route}")
+                else:
+                    print("All clients connected successfully.")
+                print("====")
+                last_report = report
+            if on_synced is not None:
+                trace('em_midisetup', 'routes synced', missing=len(missing_routes))
+                on_synced()
+                on_synced = None
+
+            wait_for_topology_change(seq, monitor)
+    finally:
+        seq.close()
+
+def main(argv=None):
+    args = parse_args(argv)
+    trace('em_midisetup', 'start')
+
+    def ready():
+        trace('em_midisetup', 'ready')
+        notify_ready()
+
+    run(args.status_file if args.monitor else None, ready)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,22 @@
+import asyncio
+import functools
 import mido
 import subprocess
 import os
+import select
+import shutil
+import threading
 import time
 import logging
 import signal
 import sys
+from collections import deque, namedtuple
+
+from alsa_midi import (ALSAError, Address, ClientExitEvent, ClientStartEvent, MidiBytesEvent, PortChangeEvent,
+                       PortExitEvent, PortStartEvent, PortType, RW_PORT, SequencerClient, SYSTEM_ANNOUNCE, WRITE_PORT)
+
+from em_boot import ReadinessListener, notify_ready, trace
+from em_midisetup import event_input
 
 MIDI_DEVICE_NAME_SUBSTRING = "MINILAB3 MIDI"
 PD_PATH = "/home/patch/Applications/pdnext/bin/pd"
@@ -14,7 +26,72 @@ USER_HOME = "/home/patch"
 PYTHON_EXEC = "/home/patch/repos/emsys/.venv/bin/python"
 EMBLISS_PACKAGE_PARENT_DIR = "/home/patch/repos/emsys" 
 EMBLISS_MODULE_NAME = "embliss.main" 
-EMBLISS_MAIN_SCRIPT = os.path.join(EMBLISS_PACKAGE_PARENT_DIR, "embliss", "main.py") # For PID check
+EMBLISS_MAIN_SCRIPT = os.path.join(EMBLISS_PACKAGE_PARENT_DIR, "embliss", "main.py") # For startup check
+
+# App names, as used for active_application and by the supervisor
+APP_PD = "pd"
+APP_EMBLISS = "embliss"
+# The broker's ALSA client and the port each app uses in place of the Minilab.
+# Embliss is pointed at its port through EMBLISS_PORT_ENV; Pd via routes.conf.
+BROKER_CLIENT_NAME = "em_ml3"
+BROKER_APP_PORTS = {APP_PD: "em_ml3_pd", APP_EMBLISS: "em_ml3_embliss"}
+EMBLISS_PORT_ENV = "EMBLISS_MIDI_PORT"
+# Where Pd reports its set position; routed from Pd's Midi-Out 4 in routes.conf.
+BROKER_PD_STATE_PORT = "em_ml3_pd_state"
+# Only used to find apps left running by an earlier controller; after that
+# the supervisor tracks them by handle.
+PD_PGREP_PATTERN = f"{PD_PATH}.*{PD_PATCH}"
+EMBLISS_PGREP_PATTERN = f"{PYTHON_EXEC}.*-m.*{EMBLISS_MODULE_NAME.split('.')[0]}"
+EMBLISS_STANDBY_ARG = "--standby"
+EMBLISS_STANDBY_PGREP_PATTERN = f"{EMBLISS_PGREP_PATTERN}.*{EMBLISS_STANDBY_ARG}"
+
+# Readiness waits. These replace fixed sleeps and are only upper bounds:
+# each returns as soon as the port or app is actually up.
+PORT_WAIT_TIMEOUT = 10        # Minilab port wait; re-scans when it expires
+PD_READY_TIMEOUT = 10         # Pd is ready once its ALSA MIDI client appears
+PD_ALSA_CLIENT_NAME = "Pure Data"
+EMBLISS_READY_TIMEOUT = 10    # Embliss sends READY=1 (sd_notify) once its display is up
+ALIVE_POLL_INTERVAL = 0.1
+APP_STOP_TIMEOUT = 2          # SIGTERM grace period before SIGKILL; stopping returns as soon as the app exits
+APP_KILL_TIMEOUT = 1
+PORT_RETRY_DELAY = 5
+SYSEX_SEND_INTERVAL = 0.05    # Gap the display writer leaves after each SysEx
+
+# Keep an embliss instance imported with its sets loaded and its broker port
+# open but idle, so starting it is just a focus handoff (SIGUSR1) and stopping
+# parks it again (SIGUSR2). Pd isn't kept warm: a second Pd would hold its own JACK client.
+EMBLISS_WARM_STANDBY = True
+EMBLISS_STANDBY_STATE = "STATUS=standby"
+
+# Crash recovery: Pd exiting on its own with an error is restarted at the
+# segment it was on. The mset comes back by itself: Pd saves the one it has
+# loaded to boot.conf. Repeated crashes back off, then restarts stop until
+# Pd is started by hand.
+PD_RESTART_DELAYS = (0, 1, 2, 5, 10)  # Before the 1st, 2nd... restart within PD_CRASH_WINDOW
+PD_CRASH_WINDOW = 120
+PD_BOOT_CONF = os.path.join(os.path.dirname(PD_PATCH), "serv", "boot.conf")
+PD_RESTORE_SEGMENT_RECEIVER = "em.restore_seg"  # serv/em.restore.pd seeks there once the mset is loaded
+# From the restarted Pd being ready: the mset loads ~1s later, em.restore.pd seeks 500ms after
+# that. Past this, segment reports count again even if the seek never landed.
+PD_RESTORE_WINDOW = 5
+# Pd sends s.seg_id.now as CC 45 on its channel 61: Midi-Out 4, channel 13
+PD_STATE_CHANNEL = 12  # mido channels count from 0
+CC_PD_SEGMENT = 45
+
+# Resource profiles, applied to each app as it's launched. The Pi has 4 cores:
+# em_clock's tick process gets core 3 (see em_clock.service), Pd cores 1-2,
+# and embliss shares core 0 with the controller and router, best-effort.
+AppProfile = namedtuple('AppProfile', 'cpus nice rt_priority memory_max io_class io_level')
+IOPRIO_CLASS_RT, IOPRIO_CLASS_BE, IOPRIO_CLASS_IDLE = 1, 2, 3
+APP_PROFILES = {
+    # Pd's -rt makes its own audio thread SCHED_FIFO; this covers the rest of it.
+    # No memory limit: being OOM-killed mid-set is worse than swapping.
+    APP_PD: AppProfile(cpus={1, 2}, nice=-10, rt_priority=None, memory_max=None,
+                       io_class=IOPRIO_CLASS_BE, io_level=0),
+    APP_EMBLISS: AppProfile(cpus={0}, nice=10, rt_priority=None, memory_max=256 * 1024 * 1024,
+                            io_class=IOPRIO_CLASS_BE, io_level=7),
+}
+CGROUP_ROOT = "/sys/fs/cgroup"
 
 # MIDI CC numbers
 CC_MODIFIER = 109
@@ -25,19 +102,34 @@ CC_REBOOT = 105
 
 # State
 cc_modifier_held = False
-_midi_input_port_ref = None
-_midi_output_port_ref = None
+broker = None              # MinilabBroker, set up by run_controller()
 active_application = None  # "pd", "embliss", or None
-embliss_process = None     
+embliss_listener = None    # ReadinessListener of the supervised embliss instance
+embliss_parked = False     # That instance is in standby, ignoring input and the display
+app_cgroups = {}           # App -> cgroup.procs of its memory-limited cgroup, from setup_app_cgroups()
+pd_segment = None          # Segment Pd last reported, restored if it crashes
+pd_segment_restoring = None  # Segment a restarted Pd was sent back to, until it reports being there
+pd_restore_deadline = None   # monotonic time PD_RESTORE_WINDOW after that Pd was ready
+pd_crash_times = deque()   # Within PD_CRASH_WINDOW, for the restart backoff
+
+# Event loop state, set up by run_controller()
+event_loop = None
+lifecycle_tasks = set()    # Starts/stops in progress or waiting their turn
+standby_task = None        # Embliss standby launch, shared by whoever needs the instance
+display_pending = {}       # SysEx for display_writer, by description; a newer one replaces an unsent one
+display_wakeup = None
+shutdown_requested = None
 
 # SysEx Configuration
 SYSEX_INIT_DATA_TUPLE = (0, 32, 107, 127, 66, 2, 2, 64, 106, 33)
 SYSEX_ARTURIA_HEADER = (0x00, 0x20, 0x6B, 0x7F, 0x42)
 SYSEX_TEXT_CMD_PREFIX = SYSEX_ARTURIA_HEADER + (0x04, 0x02, 0x60)
+SYSEX_INIT_BYTES = bytes((0xF0,) + SYSEX_INIT_DATA_TUPLE + (0xF7,))
 
 # Default display texts for when NO app is active
 TEXT_CTRL_READY_L1 = "Shift+Tap+ P5:exit" 
 TEXT_CTRL_READY_L2 = "P6:sys P7:bliss" # S+P6 for Pd, S+P7 for Embliss (Set Mgmt)
+IDLE_DISPLAY_UPDATE = "Minilab3 Display Update (Idle)"
 # TEXT_PD_ACTIVE_L1/L2 and TEXT_EMBLISS_ACTIVE_L1/L2 are removed as controller won't manage display when apps are active.
 
 
@@ -65,260 +157,844 @@ def flash_pisound_leds_on_startup():
         logging.error(f"An error occurred while trying to flash Pisound LEDs: {e}")
 
 
-def get_pd_pid():
-    # ... (implementation remains the same)
+def find_orphan_pid(pattern, exclude_arg=None):
+    """PID of a process matching pattern that this controller didn't launch, e.g. after a restart.
+
+    Processes with exclude_arg among their arguments are skipped.
+    """
     try:
-        pattern = f"{PD_PATH}.*{PD_PATCH}"
         result = subprocess.run(['pgrep', '-f', pattern], capture_output=True, text=True)
-        if result.returncode == 0 and result.stdout.strip():
-            return int(result.stdout.strip().split('\n')[0])
+        if result.returncode != 0:
+            return None
+        for pid in map(int, result.stdout.split()):
+            if exclude_arg is not None:
+                try:
+                    with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                        if exclude_arg.encode() in f.read().split(b'\0'):
+                            continue
+                except OSError:
+                    continue # Already gone
+            return pid
         return None
     except Exception as e:
-        logging.error(f"Error checking Pd PID: {e}")
+        logging.error(f"Error scanning for running apps with pgrep: {e}")
         return None
 
+def get_pd_pid():
+    return supervisor.pid(APP_PD)
+
 def get_embliss_pid():
-    # ... (implementation remains the same)
-    global embliss_process
-    if embliss_process and embliss_process.poll() is None: 
-        return embliss_process.pid
+    """PID of the embliss that owns the Minilab; a parked standby instance doesn't count."""
+    return None if embliss_parked else supervisor.pid(APP_EMBLISS)
+
+def wait_for_alsa_port(matches, timeout=None, alive=None):
+    """Blocks until an ALSA port satisfying matches(client_name, port_name) exists.
+
+    Waits on the broker's System:Announce subscription instead of polling, so it
+    returns as soon as the port shows up. Returns False on timeout or once
+    alive() goes false.
+    """
+    return broker.wait_for_port(matches, timeout, alive)
+
+def _pidfd_open(pid):
     try:
-        pattern = f"{PYTHON_EXEC}.*-m.*{EMBLISS_MODULE_NAME.split('.')[0]}" # Adjusted pgrep pattern for -m
-        # Or more specific: pattern = f"{PYTHON_EXEC} -m {EMBLISS_MODULE_NAME}"
-        # If embliss/main.py is unique enough: pattern = f"python.*{EMBLISS_MAIN_SCRIPT}"
-        result = subprocess.run(['pgrep', '-f', pattern], capture_output=True, text=True)
-        if result.returncode == 0 and result.stdout.strip():
-            return int(result.stdout.strip().split('\n')[0])
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # Not Linux >= 5.3; the watcher falls back to waiting on the handle.
         return None
-    except Exception as e:
-        logging.error(f"Error checking embliss PID with pgrep: {e}")
+
+def _own_cgroup_dir():
+    try:
+        with open('/proc/self/cgroup') as f:
+            for line in f:
+                if line.startswith('0::'): # cgroup v2
+                    return os.path.join(CGROUP_ROOT, line[3:].strip().lstrip('/'))
+    except OSError:
+        pass
+    return None
+
+def setup_app_cgroups(profiles):
+    """Creates a child cgroup per app with a memory limit; returns {app: its cgroup.procs path}.
+
+    cgroup v2 only allows processes in leaf cgroups once a controller is
+    enabled for the children, so our own processes move into a 'controller'
+    child first. That needs the service's cgroup delegated (Delegate=yes);
+    without it apps just run unlimited.
+    """
+    limited = {app: profile for app, profile in profiles.items() if profile.memory_max is not None}
+    base = _own_cgroup_dir()
+    if not limited or base is None:
+        return {}
+    try:
+        controller_procs = os.path.join(base, 'controller', 'cgroup.procs')
+        os.makedirs(os.path.dirname(controller_procs), exist_ok=True)
+        with open(os.path.join(base, 'cgroup.procs')) as f:
+            pids = [line.strip() for line in f if line.strip()]
+        for pid in pids: # Includes em_clock's tick process when run from em_services
+            with open(controller_procs, 'w') as f:
+                f.write(pid)
+        with open(os.path.join(base, 'cgroup.subtree_control'), 'w') as f:
+            f.write('+memory')
+        app_procs = {}
+        for app, profile in limited.items():
+            app_dir = os.path.join(base, app)
+            os.makedirs(app_dir, exist_ok=True)
+            with open(os.path.join(app_dir, 'memory.max'), 'w') as f:
+                f.write(str(profile.memory_max))
+            app_procs[app] = os.path.join(app_dir, 'cgroup.procs')
+        logging.info(f"App cgroups set up under {base}: {', '.join(app_procs)}")
+        return app_procs
+    except OSError as e:
+        logging.warning(f"Cannot set up app cgroups under {base} (is the service Delegate=yes?): {e}. "
+                        "Apps run without memory limits.")
+        return {}
+
+def profile_command(profile, command):
+    """Returns command prefixed with the taskset/nice/chrt/ionice wrappers that apply profile.
+
+    Each wrapper sets one attribute and execs the next, so the app keeps the
+    PID Popen returns. Unlike a preexec_fn, nothing runs in the forked copy
+    of this multi-threaded process. Missing tools are skipped with a warning;
+    log_app_resources reports what actually took effect.
+    """
+    wrappers = []
+    # taskset refuses, and the app wouldn't start, if none of the cores exist
+    cpus = sorted(cpu for cpu in profile.cpus or () if cpu < (os.cpu_count() or 1))
+    if cpus:
+        wrappers.append(['taskset', '-c', ','.join(str(cpu) for cpu in cpus)])
+    elif profile.cpus:
+        logging.warning(f"None of CPUs {sorted(profile.cpus)} exist here; launching without CPU affinity.")
+    if profile.nice is not None:
+        # nice(1) adjusts our own niceness, and the controller may be reniced itself
+        wrappers.append(['nice', '-n', str(profile.nice - os.getpriority(os.PRIO_PROCESS, 0))])
+    if profile.rt_priority is not None:
+        wrappers.append(['chrt', '-f', str(profile.rt_priority)])
+    if profile.io_class is not None:
+        # -t: run the app anyway if the class can't be set
+        io_level = [] if profile.io_class == IOPRIO_CLASS_IDLE else ['-n', str(profile.io_level)]
+        wrappers.append(['ionice', '-t', '-c', str(profile.io_class)] + io_level)
+    prefix = []
+    for wrapper in wrappers:
+        if shutil.which(wrapper[0]) is None:
+            logging.warning(f"{wrapper[0]} not found; launching without: {' '.join(wrapper)}")
+        else:
+            prefix += wrapper
+    return prefix + list(command)
+
+def move_to_cgroup(pid, cgroup_procs):
+    """Moves a just-launched app into its cgroup from here, the parent."""
+    try:
+        with open(cgroup_procs, 'w') as f:
+            f.write(str(pid))
+    except OSError as e:
+        logging.warning(f"Cannot move PID {pid} into {cgroup_procs}: {e}. It runs without its memory limit.")
+
+def log_app_resources(app):
+    try:
+        cpus = ",".join(str(cpu) for cpu in sorted(os.sched_getaffinity(app.pid)))
+        nice = os.getpriority(os.PRIO_PROCESS, app.pid)
+        policy = "SCHED_FIFO" if os.sched_getscheduler(app.pid) == os.SCHED_FIFO else "SCHED_OTHER"
+        with open(f"/proc/{app.pid}/cgroup") as f:
+            cgroup = f.read().strip().rpartition(':')[2]
+        logging.info(f"{app.name} (PID {app.pid}) resources: CPUs {cpus}, nice {nice}, {policy}, cgroup {cgroup}")
+    except (AttributeError, OSError) as e:
+        logging.debug(f"Cannot read {app.name} resources: {e}")
+
+class ManagedApp:
+    """A child app (or one adopted by PID) and its exit state."""
+    def __init__(self, name, pid, process=None):
+        self.name = name
+        self.pid = pid
+        self.process = process        # Popen handle; None when adopted
+        self.pidfd = _pidfd_open(pid)
+        self.returncode = None        # Stays None for adopted apps, which aren't our children
+        self.stopping = False         # Set by stop(), so the exit isn't reported as a crash
+        self.ready = False            # Its readiness probe passed (see launch_app)
+        self.exited = threading.Event()
+        self._lock = threading.Lock()
+
+    def running(self):
+        return not self.exited.is_set()
+
+    def send_signal(self, sig):
+        with self._lock:
+            if self.exited.is_set():
+                return
+            try:
+                if self.pidfd is not None:
+                    # Can't hit a recycled PID, unlike os.kill.
+                    signal.pidfd_send_signal(self.pidfd, sig)
+                else:
+                    os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _wait_exit(self):
+        if self.pidfd is not None:
+            poller = select.poll()
+            poller.register(self.pidfd, select.POLLIN)
+            poller.poll()
+        if self.process is not None:
+            self.returncode = self.process.wait()   # Reaps; immediate once the pidfd is readable
+        elif self.pidfd is None:
+            while True:
+                try:
+                    os.kill(self.pid, 0)
+                except ProcessLookupError:
+                    break
+                except PermissionError:
+                    pass
+                time.sleep(ALIVE_POLL_INTERVAL)
+
+    def _watch(self, on_exit):
+        self._wait_exit()
+        with self._lock:
+            self.exited.set()
+            if self.pidfd is not None:
+                os.close(self.pidfd)
+                self.pidfd = None
+        if on_exit is not None:
+            on_exit(self)
+
+class AppSupervisor:
+    """Launches Pd and embliss, keeps their handles and notices when they exit.
+
+    Each app gets a watcher thread blocked on its pidfd, so a stop takes as
+    long as the app needs to exit and a crash is seen the moment it happens,
+    instead of polling pgrep around fixed sleeps.
+    """
+    def __init__(self, on_exit=None):
+        self.on_exit = on_exit
+        self.apps = {}
+
+    def _track(self, name, pid, process=None):
+        app = ManagedApp(name, pid, process)
+        self.apps[name] = app
+        threading.Thread(target=app._watch, args=(self._exited,), name=f"watch-{name}", daemon=True).start()
+        return app
+
+    def _exited(self, app):
+        if self.apps.get(app.name) is app:
+            del self.apps[app.name]
+        if self.on_exit is not None:
+            self.on_exit(app)
+
+    def start(self, name, command, **popen_kwargs):
+        """Launches command as app name and starts watching it. Readiness is up to the caller."""
+        process = subprocess.Popen(command, **popen_kwargs)
+        app = self._track(name, process.pid, process)
+        logging.info(f"{name} start command issued (PID {app.pid}).")
+        trace('em_pd_controller', f'{name} launched', pid=app.pid)
+        return app
+
+    def adopt(self, name, pid):
+        logging.info(f"Supervising already running {name} (PID {pid}).")
+        return self._track(name, pid)
+
+    def signal(self, name, sig):
+        app = self.apps.get(name)
+        if app is None or not app.running():
+            return False
+        app.send_signal(sig)
+        return True
+
+    def pid(self, name):
+        app = self.apps.get(name)
+        return app.pid if app is not None and app.running() else None
+
+    def stop(self, name, timeout=APP_STOP_TIMEOUT):
+        """SIGTERM, then SIGKILL if the app hasn't exited within timeout. True once it's gone."""
+        app = self.apps.get(name)
+        if app is None or not app.running():
+            return True
+        app.stopping = True
+        started = time.monotonic()
+        app.send_signal(signal.SIGTERM)
+        if not app.exited.wait(timeout):
+            logging.warning(f"{name} (PID {app.pid}) did not exit within {timeout}s of SIGTERM. Sending SIGKILL.")
+            app.send_signal(signal.SIGKILL)
+            if not app.exited.wait(APP_KILL_TIMEOUT):
+                logging.error(f"{name} (PID {app.pid}) still running after SIGKILL.")
+                return False
+        logging.info(f"{name} (PID {app.pid}) exited in {time.monotonic() - started:.3f}s (code {app.returncode}).")
+        return True
+
+class MinilabBroker:
+    """Owns the Minilab3 ports and shares them between the controller and the apps.
+
+    One ALSA client, em_ml3, is subscribed to the Minilab both ways and has a
+    port per app (em_ml3_pd, em_ml3_embliss) that the app reads and writes as
+    if it were the Minilab. Minilab input goes to the controller and to the
+    app with focus; only the app with focus gets through to the Minilab. The
+    controller sends the init SysEx once per attach, so apps repeating it are
+    filtered out. Pd also reports its set position to an extra port,
+    em_ml3_pd_state, as it's the controller's one ALSA client. The same
+    System:Announce subscription that spots the Minilab leaving wakes
+    wait_for_port() callers.
+    """
+    def __init__(self, on_input=None, on_lost=None, on_pd_state=None):
+        self.on_input = on_input    # Called on the broker thread with each mido message from the Minilab
+        self.on_lost = on_lost      # Called on the broker thread when the attached Minilab goes away
+        self.on_pd_state = on_pd_state  # Called on the broker thread with each mido message from Pd's state port
+        self.focus = None
+        self.minilab = None
+        self.seq = SequencerClient(BROKER_CLIENT_NAME)
+        port_type = PortType.MIDI_GENERIC | PortType.APPLICATION
+        self.port = self.seq.create_port("minilab", RW_PORT, type=port_type)
+        self.port.connect_from(SYSTEM_ANNOUNCE)
+        self.app_ports = {app: self.seq.create_port(port_name, RW_PORT, type=port_type)
+                          for app, port_name in BROKER_APP_PORTS.items()}
+        self._apps_by_port_id = {port.port_id: app for app, port in self.app_ports.items()}
+        self.pd_state_port = self.seq.create_port(BROKER_PD_STATE_PORT, WRITE_PORT, type=port_type)
+        self._output_lock = threading.Lock()
+        self._ports_changed = threading.Condition() # Notified on each port or client announcement
+        self._wakeup_r, self._wakeup_w = os.pipe()  # Written by close() to end the blocking wait
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="minilab broker", daemon=True)
+        self._thread.start()
+
+    def find_minilab(self, device_substring=MIDI_DEVICE_NAME_SUBSTRING):
+        """Address of the Minilab's MIDI port, or None."""
+        for port in self.seq.list_ports(type=PortType.ANY, sort=False):
+            if port.client_id != self.seq.client_id and device_substring.lower() in f"{port.client_name}:{port.name}".lower():
+                logging.info(f"Found Minilab port: '{port.client_name}:{port.name}' ({port.client_id}:{port.port_id})")
+                return Address(port.client_id, port.port_id)
+        logging.warning(f"Minilab port containing '{device_substring}' not found.")
         return None
 
+    def wait_for_port(self, matches, timeout=None, alive=None):
+        """See wait_for_alsa_port(). Runs on the caller's thread; the broker thread wakes it."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            # Listed under the condition, so a port announced in between isn't missed.
+            with self._ports_changed:
+                while not any(matches(port.client_name, port.name)
+                              for port in self.seq.list_ports(type=PortType.ANY, sort=False)):
+                    if alive is not None and not alive():
+                        return False
+                    waits = [ALIVE_POLL_INTERVAL] if alive is not None else []
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        waits.append(remaining)
+                    self._ports_changed.wait(min(waits) if waits else None)
+            return True
+        except ALSAError as e:
+            logging.error(f"Error waiting for ALSA port: {e}")
+            return False
+
+    def attach(self, address):
+        with self._output_lock:
+            self.port.connect_from(address)
+            self.port.connect_to(address)
+        self.minilab = address
+
+    def detach(self):
+        address, self.minilab = self.minilab, None
+        if address is None:
+            return
+        with self._output_lock:
+            for disconnect in (self.port.disconnect_from, self.port.disconnect_to):
+                try:
+                    disconnect(address)
+                except ALSAError:
+                    pass # Already gone with the device
+
+    def set_focus(self, app):
+        if app != self.focus:
+            logging.info(f"Minilab focus: {app or 'controller'}")
+        self.focus = app
+
+    def send(self, midi_bytes):
+        """Sends raw MIDI bytes to the Minilab; False if none is attached."""
+        if self.minilab is None:
+            return False
+        with self._output_lock:
+            self.seq.event_output(MidiBytesEvent(midi_bytes), port=self.port)
+            self.seq.drain_output()
+        return True
+
+    def _forward_to_app(self, midi_bytes):
+        port = self.app_ports.get(self.focus)
+        if port is not None:
+            with self._output_lock:
+                self.seq.event_output(MidiBytesEvent(midi_bytes), port=port)
+                self.seq.drain_output()
+
+    def _forward_from_app(self, app, midi_bytes):
+        if app is None or app != self.focus:
+            logging.debug(f"Dropped message from {app}: it doesn't have focus.")
+        elif midi_bytes == SYSEX_INIT_BYTES:
+            logging.debug(f"Dropped repeated Minilab init SysEx from {app}.")
+        else:
+            self.send(midi_bytes)
+
+    @staticmethod
+    def _deliver(callback, midi_bytes):
+        if callback is not None:
+            try:
+                callback(mido.Message.from_bytes(midi_bytes))
+            except ValueError:
+                pass # Not a complete message mido understands
+
+    def _run(self):
+        while self._running:
+            try:
+                event = event_input(self.seq, wakeup_fd=self._wakeup_r, prefer_bytes=True)
+                if event is None:
+                    continue # Woken by close()
+                if isinstance(event, (ClientStartEvent, PortStartEvent, PortChangeEvent)):
+                    with self._ports_changed:
+                        self._ports_changed.notify_all()
+                elif isinstance(event, (ClientExitEvent, PortExitEvent)):
+                    lost = self.minilab is not None and event.addr.client_id == self.minilab.client_id and \
+                        (isinstance(event, ClientExitEvent) or event.addr.port_id == self.minilab.port_id)
+                    if lost:
+                        self.minilab = None
+                        if self.on_lost is not None:
+                            self.on_lost()
+                elif not isinstance(event, MidiBytesEvent):
+                    continue
+                elif event.dest.port_id == self.port.port_id:
+                    self._forward_to_app(event.midi_bytes)
+                    self._deliver(self.on_input, event.midi_bytes)
+                elif event.dest.port_id == self.pd_state_port.port_id:
+                    self._deliver(self.on_pd_state, event.midi_bytes)
+                else:
+                    self._forward_from_app(self._apps_by_port_id.get(event.dest.port_id), event.midi_bytes)
+            except ALSAError as e:
+                if self._running:
+                    logging.error(f"Minilab broker error: {e}")
+
+    def close(self):
+        self._running = False
+        os.write(self._wakeup_w, b"\0")
+        self._thread.join()
+        self.seq.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+def set_active(app):
+    """Marks app (or None for the controller) active and gives it the Minilab."""
+    global active_application
+    active_application = app
+    if broker is not None:
+        broker.set_focus(app)
+
+def on_app_exit(app):
+    # Watcher thread: hand over to the event loop, which owns the controller state
+    if event_loop is not None and event_loop.is_running():
+        event_loop.call_soon_threadsafe(handle_app_exit, app)
+    else:
+        handle_app_exit(app)
+
+def handle_app_exit(app):
+    """Runs on the event loop whenever a supervised app exits."""
+    global embliss_parked
+    if app.name == APP_EMBLISS:
+        embliss_parked = False
+    if app.stopping:
+        return
+    logging.warning(f"{app.name} (PID {app.pid}) exited unexpectedly (code {app.returncode}).")
+    if active_application == app.name:
+        set_active(None)
+        if app.name == APP_PD and exited_with_error(app) and \
+                shutdown_requested is not None and not shutdown_requested.is_set():
+            schedule_pd_restart()
+        else:
+            update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
+
+def exited_with_error(app):
+    """True if app failed or was killed. An adopted app's exit code is unknown (None), so that isn't a crash."""
+    return app.returncode is not None and app.returncode != 0
+
+def schedule_pd_restart():
+    """Restarts Pd after a crash, backing off as crashes repeat within PD_CRASH_WINDOW."""
+    global pd_segment, pd_segment_restoring
+    now = time.monotonic()
+    while pd_crash_times and now - pd_crash_times[0] > PD_CRASH_WINDOW:
+        pd_crash_times.popleft()
+    pd_crash_times.append(now)
+    if len(pd_crash_times) > len(PD_RESTART_DELAYS):
+        logging.error(f"Pd crashed {len(pd_crash_times)} times within {PD_CRASH_WINDOW}s. "
+                      "Not restarting it until it's started again by hand.")
+        pd_segment = pd_segment_restoring = None # Stale by the time Pd is started again
+        update_minilab_display_if_idle("Pd crash loop", TEXT_CTRL_READY_L2)
+        return
+    delay = PD_RESTART_DELAYS[len(pd_crash_times) - 1]
+    logging.warning(f"Restarting Pd in {delay}s with mset {read_boot_param('mset')} at segment {pd_segment}.")
+    update_minilab_display_if_idle("Pd crashed", f"Restart in {delay}s" if delay else "Restarting...")
+    # A "start" task, so Shift+Tap+NO cancels it like any other start
+    run_lifecycle("start pd (crash restart)", functools.partial(restart_pd_app, delay, pd_segment))
+
+def read_boot_param(name):
+    """A parameter from Pd's boot.conf ("name value;" lines), or None."""
+    try:
+        with open(PD_BOOT_CONF) as f:
+            for line in f:
+                key, _, value = line.strip().rstrip(';').partition(' ')
+                if key == name:
+                    return value.strip()
+    except OSError:
+        pass
+    return None
+
+def record_pd_state(msg):
+    """Runs on the event loop with each message Pd sends to the broker's state port."""
+    global pd_segment, pd_segment_restoring
+    if msg.type != 'control_change' or msg.channel != PD_STATE_CHANNEL or msg.control != CC_PD_SEGMENT:
+        return
+    if pd_segment_restoring is not None:
+        if msg.value == pd_segment_restoring:
+            logging.info(f"Pd is back at segment {msg.value}.")
+        elif pd_restore_deadline is None or time.monotonic() < pd_restore_deadline:
+            return # The reloaded mset starting from the top, before it seeks back
+        else:
+            # The mset didn't load, the segment is gone, or the set has moved on since
+            logging.warning(f"Pd didn't get back to segment {pd_segment_restoring}; "
+                            f"following it from segment {msg.value}.")
+        pd_segment_restoring = None
+    pd_segment = msg.value
+
+supervisor = AppSupervisor(on_exit=on_app_exit)
+
+async def run_blocking_wait(wait, *args, alive=None, **kwargs):
+    """Runs one of the blocking wait helpers in a thread, so cancelling the task ends the wait.
+
+    The helpers check alive() every ALIVE_POLL_INTERVAL; that's how the
+    cancellation reaches the thread.
+    """
+    cancelled = threading.Event()
+    def still_wanted():
+        return not cancelled.is_set() and (alive is None or alive())
+    try:
+        return await asyncio.to_thread(wait, *args, alive=still_wanted, **kwargs)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+async def launch_app(name, command, ready, **popen_kwargs):
+    """Starts an app under the supervisor with its resource profile, then runs its readiness probe ready(alive=...)."""
+    if name in APP_PROFILES:
+        command = profile_command(APP_PROFILES[name], command)
+    app = supervisor.start(name, command, **popen_kwargs)
+    if name in app_cgroups:
+        move_to_cgroup(app.pid, app_cgroups[name])
+    app.ready = await run_blocking_wait(ready, alive=app.running)
+    if app.running():
+        # Only now: right after the launch the wrappers may not have exec'd through to the app yet
+        log_app_resources(app)
+    if app.ready:
+        trace('em_pd_controller', f'{name} ready')
+    elif app.running():
+        logging.warning(f"{name} did not report ready; carrying on.")
+    return app
+
+def queue_sysex(sysex_data_tuple, description):
+    """Queues SysEx for display_writer; replaces an unsent message with the same description."""
+    display_pending.pop(description, None)
+    display_pending[description] = sysex_data_tuple
+    if display_wakeup is not None:
+        display_wakeup.set()
+
 def update_minilab_display_if_idle(line1, line2):
     """Updates display ONLY if no other application is supposed to be active."""
     if active_application is None:
-        if _midi_output_port_ref and not _midi_output_port_ref.closed:
+        if broker is not None and broker.minilab is not None:
             text_data = construct_text_sysex(line1, line2)
             if text_data:
-                send_sysex_message(_midi_output_port_ref, text_data, "Minilab3 Display Update (Idle)")
+                queue_sysex(text_data, IDLE_DISPLAY_UPDATE)
         else:
             logging.warning("Cannot update Minilab display: Output port not available.")
     else:
         logging.debug(f"Display update suppressed: App '{active_application}' is active.")
 
+async def display_writer():
+    """Sends queued SysEx to the Minilab, paced so it keeps up."""
+    while True:
+        await display_wakeup.wait()
+        display_wakeup.clear()
+        while display_pending:
+            description = next(iter(display_pending))
+            sysex_data = display_pending.pop(description)
+            if description == IDLE_DISPLAY_UPDATE and active_application is not None:
+                continue # An app took over the screen since this was queued
+            if broker is not None and broker.minilab is not None:
+                send_sysex_message(sysex_data, description)
+                await asyncio.sleep(SYSEX_SEND_INTERVAL)
 
-def start_pd_app():
-    global active_application
+async def start_pd_app(after_crash=False, restore_segment=None):
+    """Starts Pd. After a crash, restore_segment has it seek back to that segment once its mset is loaded."""
+    global pd_segment, pd_segment_restoring, pd_restore_deadline
     if active_application is not None:
         logging.warning(f"Cannot start Pd: App '{active_application}' is already active. Stop it first.")
-        # Optionally, send a message to display like "Stop app first"
-        # update_minilab_display_if_idle("Stop current app", f"Then S+P6:PD") # This would show if idle
         return
 
     pid = get_pd_pid()
     if pid:
         logging.info(f"Pd is already running (PID {pid}), but not marked active. Marking active.")
-        active_application = "pd"
+        set_active(APP_PD)
         # No display update here; Pd will control its display.
         return
     
     logging.info(f"Attempting to start Pd: {PD_PATH} with patch {PD_PATCH}")
     pd_env = os.environ.copy()
     pd_env["JACK_PROMISCUOUS_SERVER"] = "jack"; pd_env["DISPLAY"] = ":0"; pd_env["HOME"] = USER_HOME
-    command = [PD_PATH, "-jack", "-rt", "-nogui", PD_PATCH]
+    command = [PD_PATH, "-jack", "-rt", "-nogui"]
+    if after_crash:
+        if restore_segment is not None:
+            command += ["-send", f"{PD_RESTORE_SEGMENT_RECEIVER} {restore_segment}"]
+            pd_segment_restoring = restore_segment
+            pd_restore_deadline = None # Set once it's ready
+    else:
+        # Started by hand: a fresh set, and a clean slate for crash backoff
+        pd_segment = pd_segment_restoring = None
+        pd_crash_times.clear()
+    command.append(PD_PATCH)
+    # Pd is usable once its ALSA MIDI client exists
+    pd_ready = functools.partial(wait_for_alsa_port, lambda client, port: PD_ALSA_CLIENT_NAME in client,
+                                 PD_READY_TIMEOUT)
+    broker.set_focus(APP_PD) # Pd draws its first screen before it's ready
     try:
-        subprocess.Popen(command, env=pd_env)
-        logging.info("Pd start command issued.")
-        time.sleep(1.5) # Increased sleep to allow Pd to potentially take over display
-        if get_pd_pid():
-            logging.info("Pd started successfully.")
-            active_application = "pd"
-            # NO display update from controller - Pd is now in charge of the screen
-        else:
-            logging.warning("Pd process not found after start command.")
-            active_application = None # Ensure state is None
-            update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
+        app = await launch_app(APP_PD, command, pd_ready, env=pd_env)
+    except asyncio.CancelledError:
+        logging.info("Pd start cancelled.")
+        # The stop that cancelled us takes it down next
+        set_active(APP_PD)
+        raise
     except Exception as e:
         logging.error(f"Failed to start Pd: {e}")
-        active_application = None
+        set_active(None)
         update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
+        return
+    if app.running():
+        logging.info(f"Pd started successfully with PID {app.pid}.")
+        if pd_segment_restoring is not None:
+            pd_restore_deadline = time.monotonic() + PD_RESTORE_WINDOW
+        set_active(APP_PD)
+        # NO display update from controller - Pd is now in charge of the screen
+    else:
+        logging.warning(f"Pd exited during startup. Exit code: {app.returncode}")
+        set_active(None) # Ensure state is None
+        if after_crash and exited_with_error(app):
+            schedule_pd_restart() # Counts towards the backoff like any other crash
+        else:
+            update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
 
-def stop_pd_app():
-    global active_application
+async def restart_pd_app(delay, segment):
+    if delay:
+        await asyncio.sleep(delay)
+    await start_pd_app(after_crash=True, restore_segment=segment)
+
+async def stop_pd_app():
     pid = get_pd_pid()
     if not pid:
         logging.info("Pd is not running. Stop command ignored.")
-        if active_application == "pd": # Correct state if it was marked active
-            active_application = None
+        if active_application == APP_PD: # Correct state if it was marked active
+            set_active(None)
             update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
         return
 
     logging.info(f"Attempting to stop Pd with PID {pid}.")
-    try:
-        subprocess.run(['kill', str(pid)], check=True) 
-        time.sleep(0.5) 
-        if get_pd_pid() is None:
-            logging.info(f"Pd PID {pid} stopped successfully with SIGTERM.")
-        else: 
-            logging.warning(f"Pd PID {pid} did not stop with SIGTERM. Sending SIGKILL.")
-            subprocess.run(['kill', '-9', str(pid)], check=True)
-            time.sleep(0.5)
-            if get_pd_pid() is None: logging.info(f"Pd PID {pid} stopped successfully with SIGKILL.")
-            else: logging.error(f"Failed to stop Pd PID {pid} even with SIGKILL.")
-    except Exception as e:
-        logging.error(f"Error stopping Pd: {e}")
-
-    if get_pd_pid() is None: 
+    if await asyncio.to_thread(supervisor.stop, APP_PD):
         logging.info("Pd confirmed stopped.")
-        if active_application == "pd": active_application = None
+        if active_application == APP_PD: set_active(None)
         update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
     else:
         logging.error("Pd failed to stop. State may be inconsistent.")
         # Don't update display, as Pd might still be controlling it or in a bad state.
 
-def start_embliss_app():
-    global active_application, embliss_process
+def embliss_running():
+    return supervisor.pid(APP_EMBLISS) is not None
+
+async def launch_embliss_standby():
+    """Starts embliss with --standby; True once it's parked (imported, sets loaded, port open but idle)."""
+    global embliss_listener, embliss_parked
+    if embliss_listener:
+        embliss_listener.close()
+    embliss_listener = ReadinessListener("em_pd_controller")
+    logging.info(f"Starting Embliss in standby: {PYTHON_EXEC} -m {EMBLISS_MODULE_NAME} {EMBLISS_STANDBY_ARG}")
+    app = await launch_app(
+        APP_EMBLISS, [PYTHON_EXEC, "-m", EMBLISS_MODULE_NAME, EMBLISS_STANDBY_ARG],
+        functools.partial(embliss_listener.wait_for, EMBLISS_STANDBY_STATE, EMBLISS_READY_TIMEOUT),
+        cwd=EMBLISS_PACKAGE_PARENT_DIR,
+        env={**os.environ, **embliss_listener.env(), EMBLISS_PORT_ENV: BROKER_APP_PORTS[APP_EMBLISS]}
+    )
+    if app.running() and not app.ready:
+        # Signals sent before it reaches standby would kill it
+        logging.warning(f"Embliss did not reach standby within {EMBLISS_READY_TIMEOUT}s. Stopping it.")
+        await asyncio.to_thread(supervisor.stop, APP_EMBLISS)
+    embliss_parked = app.ready and app.running()
+    return embliss_parked
+
+async def ensure_embliss_standby():
+    """True once there's a parked embliss instance, launching one if needed."""
+    global standby_task
+    if embliss_parked:
+        return True
+    if standby_task is None or standby_task.done():
+        if embliss_running(): # Active, or adopted: nothing to park
+            return False
+        standby_task = event_loop.create_task(launch_embliss_standby(), name="embliss standby")
+    # Shielded, so a cancelled start leaves the instance to finish parking
+    return await asyncio.shield(standby_task)
+
+async def prepare_embliss_standby():
+    try:
+        await ensure_embliss_standby()
+    except Exception as e:
+        logging.error(f"Failed to prepare Embliss standby: {e}", exc_info=True)
+
+async def start_embliss_app():
+    global embliss_parked
     if active_application is not None:
         logging.warning(f"Cannot start Embliss: App '{active_application}' is already active. Stop it first.")
         return
 
-    if get_embliss_pid(): # Check if it's somehow already running
-        logging.info(f"Embliss is already running (PID {get_embliss_pid()}), but not marked active. Marking active.")
-        active_application = "embliss"
-        embliss_process = None # We don't have the handle, so pgrep will be used by get_embliss_pid
+    launching = standby_task is not None and not standby_task.done()
+    pid = supervisor.pid(APP_EMBLISS)
+    if pid and not embliss_parked and not launching: # Adopted from an earlier controller: no standby to wake
+        logging.info(f"Embliss is already running (PID {pid}), but not marked active. Marking active.")
+        set_active(APP_EMBLISS)
         # No display update here; Embliss will control its display.
         return
 
-    logging.info(f"Attempting to start Embliss: {PYTHON_EXEC} -m {EMBLISS_MODULE_NAME}")
     try:
-        embliss_process = subprocess.Popen(
-            [PYTHON_EXEC, "-m", EMBLISS_MODULE_NAME], 
-            cwd=EMBLISS_PACKAGE_PARENT_DIR
-        )
-        logging.info("Embliss start command issued.")
-        time.sleep(1.5) # Increased sleep
-        if embliss_process.poll() is None: 
-            logging.info(f"Embliss started successfully with PID {embliss_process.pid}.")
-            active_application = "embliss"
-            # NO display update from controller - Embliss is in charge
-        else:
-            logging.warning(f"Embliss process not found or exited quickly. Exit code: {embliss_process.returncode}")
-            embliss_process = None
-            active_application = None
-            update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
+        parked = await ensure_embliss_standby()
+    except asyncio.CancelledError:
+        logging.info("Embliss start cancelled before activation.")
+        raise
     except Exception as e:
         logging.error(f"Failed to start Embliss: {e}", exc_info=True)
-        embliss_process = None
-        active_application = None
+        parked = False
+    if not parked:
+        set_active(None)
         update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
+        return
 
-def stop_embliss_app():
-    global active_application, embliss_process
-    pid_check = get_embliss_pid() # Use the function that checks both handle and pgrep
-    
-    if not pid_check:
+    started = time.monotonic()
+    logging.info("Activating Embliss...")
+    broker.set_focus(APP_EMBLISS)
+    supervisor.signal(APP_EMBLISS, signal.SIGUSR1)
+    embliss_parked = False
+    try:
+        # Embliss sends READY=1 once it holds the ports and its display is up
+        ready = await run_blocking_wait(embliss_listener.wait_ready, EMBLISS_READY_TIMEOUT, alive=embliss_running)
+    except asyncio.CancelledError:
+        logging.info("Embliss start cancelled.")
+        # The stop that cancelled us parks it again next
+        set_active(APP_EMBLISS)
+        raise
+    if ready:
+        trace('em_pd_controller', 'embliss active')
+        logging.info(f"Embliss active in {time.monotonic() - started:.3f}s (PID {get_embliss_pid()}).")
+        set_active(APP_EMBLISS)
+        # NO display update from controller - Embliss is in charge
+    elif get_embliss_pid():
+        logging.warning(f"Embliss did not report ready within {EMBLISS_READY_TIMEOUT}s.")
+        set_active(APP_EMBLISS)
+    else:
+        logging.warning("Embliss exited during activation.")
+        set_active(None)
+        update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
+
+async def stop_embliss_app():
+    global embliss_parked
+    pid = get_embliss_pid()
+    if not pid:
         logging.info("Embliss is not running. Stop command ignored.")
-        if embliss_process: embliss_process = None 
-        if active_application == "embliss":
-            active_application = None
+        if active_application == APP_EMBLISS:
+            set_active(None)
             update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
         return
 
-    actual_pid_to_stop = embliss_process.pid if embliss_process and embliss_process.poll() is None else pid_check
-    logging.info(f"Attempting to stop Embliss with PID {actual_pid_to_stop}.")
-    
-    try:
-        if embliss_process and embliss_process.pid == actual_pid_to_stop : # If we have the correct Popen object
-            embliss_process.terminate() 
-            try: embliss_process.wait(timeout=2)
-            except subprocess.TimeoutExpired:
-                logging.warning(f"Embliss PID {actual_pid_to_stop} (handle) did not terminate. Killing.")
-                embliss_process.kill(); embliss_process.wait(timeout=1)
-        else: # Fallback to command line kill
-            subprocess.run(['kill', str(actual_pid_to_stop)], check=True) 
-            time.sleep(0.5)
-            if get_embliss_pid() is None: logging.info(f"Embliss PID {actual_pid_to_stop} (cmd) stopped with SIGTERM.")
-            else:
-                subprocess.run(['kill', '-9', str(actual_pid_to_stop)], check=True); time.sleep(0.5)
-                if get_embliss_pid() is None: logging.info(f"Embliss PID {actual_pid_to_stop} (cmd) stopped with SIGKILL.")
-                else: logging.error(f"Failed to stop Embliss PID {actual_pid_to_stop} (cmd) with SIGKILL.")
-    except Exception as e:
-        logging.error(f"Error stopping Embliss: {e}")
-    finally:
-        embliss_process = None 
+    if EMBLISS_WARM_STANDBY and embliss_listener:
+        logging.info(f"Returning Embliss (PID {pid}) to standby.")
+        supervisor.signal(APP_EMBLISS, signal.SIGUSR2)
+        # It clears the display and lets go of input before reporting standby
+        if await run_blocking_wait(embliss_listener.wait_for, EMBLISS_STANDBY_STATE, APP_STOP_TIMEOUT,
+                                   alive=embliss_running):
+            embliss_parked = True
+            logging.info("Embliss parked in standby.")
+            if active_application == APP_EMBLISS: set_active(None)
+            update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
+            return
+        logging.warning("Embliss did not return to standby. Stopping it.")
 
-    if get_embliss_pid() is None: 
+    logging.info(f"Attempting to stop Embliss with PID {pid}.")
+    if await asyncio.to_thread(supervisor.stop, APP_EMBLISS):
         logging.info("Embliss confirmed stopped.")
-        if active_application == "embliss": active_application = None
+        if active_application == APP_EMBLISS: set_active(None)
         update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
     else:
         logging.error("Embliss failed to stop. State may be inconsistent.")
 
-def stop_currently_active_app():
-    # ... (implementation remains similar, calls stop_pd_app or stop_embliss_app) ...
-    global active_application
+async def stop_currently_active_app():
     logging.info(f"Stop active app command received. Current active: {active_application}")
-    if active_application == "pd":
-        stop_pd_app()
-    elif active_application == "embliss":
-        stop_embliss_app()
+    if active_application == APP_PD:
+        await stop_pd_app()
+    elif active_application == APP_EMBLISS:
+        await stop_embliss_app()
     else:
         logging.info("No application was marked as active to stop.")
         # Check and stop if any are running orphan
         pd_running = get_pd_pid()
-        embliss_running = get_embliss_pid()
+        embliss_running_pid = get_embliss_pid()
         if pd_running:
             logging.info(f"Found orphaned Pd (PID {pd_running}). Stopping it.")
-            stop_pd_app()
-        if embliss_running: # Check again after potential pd stop
-            logging.info(f"Found orphaned Embliss (PID {embliss_running}). Stopping it.")
-            stop_embliss_app()
+            await stop_pd_app()
+        if embliss_running_pid: # Check again after potential pd stop
+            logging.info(f"Found orphaned Embliss (PID {embliss_running_pid}). Stopping it.")
+            await stop_embliss_app()
         
         # If neither was running or after stopping orphans, ensure idle display
         if not get_pd_pid() and not get_embliss_pid():
              update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
 
-
-def reboot_system():
-    # ... (implementation remains the same) ...
+async def reboot_system():
     logging.info("Reboot command received. Initiating system reboot...")
     try:
-        if active_application == "pd": stop_pd_app()
-        elif active_application == "embliss": stop_embliss_app()
-        time.sleep(0.5) # Give a moment for apps to close
-        subprocess.run(['sudo', 'reboot'], check=True)
+        if active_application == APP_PD: await stop_pd_app()
+        elif active_application == APP_EMBLISS: await stop_embliss_app()
+        await asyncio.to_thread(subprocess.run, ['sudo', 'reboot'], check=True)
     except Exception as e:
         logging.error(f"Failed to reboot system: {e}")
 
-def find_midi_input_port_name(device_substring):
-    # ... (implementation remains the same) ...
-    try:
-        for port_name in mido.get_input_names():
-            if device_substring.lower() in port_name.lower():
-                logging.info(f"Found MIDI input port: '{port_name}'")
-                return port_name
-        logging.warning(f"MIDI input port containing '{device_substring}' not found. Available: {mido.get_input_names()}")
-    except Exception as e: logging.error(f"Error enumerating MIDI input ports: {e}")
-    return None
+def run_lifecycle(name, command, preempt_starts=False):
+    """Runs command() (a start/stop coroutine) as a task once earlier ones are done.
 
-def find_midi_output_port_name(device_substring):
-    # ... (implementation remains the same) ...
-    try:
-        for port_name in mido.get_output_names():
-            if device_substring.lower() in port_name.lower():
-                logging.info(f"Found MIDI output port: '{port_name}'")
-                return port_name
-        logging.warning(f"MIDI output port containing '{device_substring}' not found. Available: {mido.get_output_names()}")
-    except Exception as e: logging.error(f"Error enumerating MIDI output ports: {e}")
-    return None
+    With preempt_starts, starts still in progress are cancelled instead of
+    waited for, so a stop press doesn't sit behind a slow start.
+    """
+    pending = [task for task in lifecycle_tasks if not task.done()]
+    if preempt_starts:
+        for task in pending:
+            if task.get_name().startswith("start"):
+                logging.info(f"Cancelling '{task.get_name()}' in progress.")
+                task.cancel()
 
-def send_sysex_message(out_port, sysex_data_tuple, description="SysEx"):
-    # ... (implementation remains the same) ...
+    async def run():
+        if pending:
+            await asyncio.wait(pending)
+        await command()
+
+    task = event_loop.create_task(run(), name=name)
+    lifecycle_tasks.add(task)
+    task.add_done_callback(_lifecycle_done)
+    return task
+
+def _lifecycle_done(task):
+    lifecycle_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"'{task.get_name()}' failed: {task.exception()}", exc_info=task.exception())
+
+def send_sysex_message(sysex_data_tuple, description="SysEx"):
     try:
-        msg = mido.Message('sysex', data=sysex_data_tuple)
-        out_port.send(msg)
-        logging.debug(f"Sent {description} (data: {sysex_data_tuple})") 
-        time.sleep(0.05) 
+        if broker is not None and broker.send(mido.Message('sysex', data=sysex_data_tuple).bin()):
+            logging.debug(f"Sent {description} (data: {sysex_data_tuple})") 
+        else:
+            logging.warning(f"Cannot send {description}: Minilab not attached.")
     except Exception as e: logging.error(f"Failed to send {description} message: {e}")
 
 def construct_text_sysex(line1_text, line2_text):
@@ -330,10 +1006,14 @@ def construct_text_sysex(line1_text, line2_text):
         return text_data
     except Exception as e: logging.error(f"Error constructing text SysEx: {e}"); return None
 
-def process_midi_input(in_port):
-    # ... (implementation remains the same, calls new start/stop functions) ...
+async def process_midi_input(input_queue):
+    """Dispatches Minilab input. Commands run as tasks, so input never waits behind them.
+
+    Returns True after a reboot command.
+    """
     global cc_modifier_held
-    for msg in in_port:
+    while True:
+        msg = await input_queue.get()
         logging.debug(f"Received MIDI message: {msg}")
         if msg.type == 'control_change':
             if msg.control == CC_MODIFIER:
@@ -344,145 +1024,158 @@ def process_midi_input(in_port):
             elif cc_modifier_held and msg.value > 0: 
                 if msg.control == CC_START_PD:
                     logging.info(f"Start Pd command (CC {CC_START_PD}) with modifier.")
-                    start_pd_app()
+                    run_lifecycle("start pd", start_pd_app)
                 elif msg.control == CC_START_EMBLISS:
                     logging.info(f"Start Embliss command (CC {CC_START_EMBLISS}) with modifier.")
-                    start_embliss_app()
+                    run_lifecycle("start embliss", start_embliss_app)
                 elif msg.control == CC_STOP_APP:
                     logging.info(f"Stop Active App command (CC {CC_STOP_APP}) with modifier.")
-                    stop_currently_active_app()
+                    run_lifecycle("stop", stop_currently_active_app, preempt_starts=True)
                 elif msg.control == CC_REBOOT:
                     logging.info(f"Reboot command (CC {CC_REBOOT}) with modifier.")
-                    reboot_system()
+                    await run_lifecycle("reboot", reboot_system, preempt_starts=True)
                     logging.info("Exiting script after reboot command.")
                     return True 
-    return False 
 
-def signal_handler_main(sig, frame):
-    # ... (implementation remains similar, ensures embliss_process is handled) ...
-    global _midi_input_port_ref, _midi_output_port_ref, embliss_process
+async def minilab_session():
+    """Attaches the broker to the Minilab and handles its input until it goes away.
+
+    Returns True after a reboot command.
+    """
+    global cc_modifier_held
+    address = broker.find_minilab()
+    if address is None:
+        # Match the port the same way on the ALSA side
+        await run_blocking_wait(wait_for_alsa_port,
+                                lambda client, port: MIDI_DEVICE_NAME_SUBSTRING.lower() in f"{client}:{port}".lower(),
+                                PORT_WAIT_TIMEOUT)
+        return False
+
+    input_queue = asyncio.Queue()
+    lost = asyncio.Event()
+    # The broker calls back on its own thread; the queue belongs to the event loop
+    broker.on_input = lambda msg: event_loop.call_soon_threadsafe(input_queue.put_nowait, msg)
+    broker.on_lost = lambda: event_loop.call_soon_threadsafe(lost.set)
+    try:
+        broker.attach(address)
+        logging.info(f"Minilab attached to {BROKER_CLIENT_NAME} ({address.client_id}:{address.port_id}).")
+        trace('em_pd_controller', 'minilab open')
+        # The only init the Minilab gets; the broker drops the apps' copies
+        queue_sysex(SYSEX_INIT_DATA_TUPLE, "Minilab3 Init on Port Open")
+        update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2) # Update based on current idle state
+        cc_modifier_held = False
+
+        commands = event_loop.create_task(process_midi_input(input_queue), name="minilab input")
+        unplugged = event_loop.create_task(lost.wait(), name="minilab lost")
+        try:
+            done, _ = await asyncio.wait({commands, unplugged}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            commands.cancel(); unplugged.cancel()
+        if commands in done:
+            return commands.result()
+        logging.warning("Minilab disconnected. Reconnecting...")
+        return False
+    finally:
+        broker.on_input = broker.on_lost = None
+        broker.detach()
+
+def request_shutdown(sig):
     logging.info(f"Signal {signal.Signals(sig).name} received, em_pd_controller shutting down...")
-    
-    if embliss_process and embliss_process.poll() is None:
+    shutdown_requested.set()
+
+async def shutdown():
+    for task in list(lifecycle_tasks):
+        task.cancel()
+    if embliss_running(): # Parked or not
         logging.info("Attempting to stop Embliss subprocess before exiting...")
-        embliss_process.terminate()
-        try: embliss_process.wait(timeout=1)
-        except subprocess.TimeoutExpired: embliss_process.kill()
+        await asyncio.to_thread(supervisor.stop, APP_EMBLISS, 1)
         logging.info("Embliss subprocess stop attempt complete.")
-    
-    if _midi_output_port_ref and not _midi_output_port_ref.closed: # Check output port first for final message
-        try: 
-            update_minilab_display_if_idle("Controller", "Exiting...") 
-            time.sleep(0.1)
-        except Exception as e: logging.error(f"Error sending exit message: {e}")
-        finally: # Ensure port is closed even if message fails
-            try: _midi_output_port_ref.close(); logging.info("MIDI output port closed.")
-            except Exception as e: logging.error(f"Error closing MIDI output port: {e}")
-            _midi_output_port_ref = None # Clear ref
-
-    if _midi_input_port_ref and hasattr(_midi_input_port_ref, 'close') and not _midi_input_port_ref.closed:
-        try: _midi_input_port_ref.close(); logging.info("MIDI input port closed.")
-        except Exception as e: logging.error(f"Error closing MIDI input port: {e}")
-        _midi_input_port_ref = None # Clear ref
-    sys.exit(0)
 
-def main_loop():
-    # ... (Initial display logic needs to use update_minilab_display_if_idle) ...
-    global _midi_input_port_ref, _midi_output_port_ref, active_application
+    if broker.minilab is not None and active_application is None:
+        # Sent directly: the display writer is about to go
+        try:
+            send_sysex_message(construct_text_sysex("Controller", "Exiting..."), "Minilab3 Display Update (Exit)")
+            await asyncio.sleep(SYSEX_SEND_INTERVAL)
+        except Exception as e: logging.error(f"Error sending exit message: {e}")
 
-    signal.signal(signal.SIGINT, signal_handler_main)
-    signal.signal(signal.SIGTERM, signal_handler_main)
+async def run_controller():
+    global event_loop, display_wakeup, shutdown_requested, broker, app_cgroups
+    event_loop = asyncio.get_running_loop()
+    app_cgroups = setup_app_cgroups(APP_PROFILES)
+    broker = MinilabBroker(on_pd_state=lambda msg: event_loop.call_soon_threadsafe(record_pd_state, msg))
+    display_wakeup = asyncio.Event()
+    shutdown_requested = asyncio.Event()
+    event_loop.add_signal_handler(signal.SIGINT, request_shutdown, signal.SIGINT)
+    event_loop.add_signal_handler(signal.SIGTERM, request_shutdown, signal.SIGTERM)
 
-    target_input_port_name = None
-    target_output_port_name = None
-    
     # Determine initial state without sending display updates yet,
-    # as MIDI ports might not be open.
-    if get_pd_pid():
-        active_application = "pd"
+    # as MIDI ports might not be open. Apps left by an earlier controller
+    # are adopted so they can be stopped and watched like our own.
+    if (pid := find_orphan_pid(EMBLISS_STANDBY_PGREP_PATTERN)):
+        # Launched as a standby, so it reports to the earlier controller's readiness
+        # socket and can't be woken or parked from here (even if it's active now).
+        logging.info(f"Stopping Embliss (PID {pid}) left in standby mode by an earlier controller.")
+        supervisor.adopt(APP_EMBLISS, pid)
+        await asyncio.to_thread(supervisor.stop, APP_EMBLISS)
+    if (pid := find_orphan_pid(PD_PGREP_PATTERN)):
+        supervisor.adopt(APP_PD, pid)
+        set_active(APP_PD)
         logging.info("Found Pd running on startup.")
-    elif get_embliss_pid():
-        active_application = "embliss"
+    elif (pid := find_orphan_pid(EMBLISS_PGREP_PATTERN, exclude_arg=EMBLISS_STANDBY_ARG)):
+        supervisor.adopt(APP_EMBLISS, pid)
+        set_active(APP_EMBLISS)
         logging.info("Found Embliss running on startup.")
     else:
-        active_application = None
+        set_active(None)
         logging.info("No app found running on startup.")
+    if EMBLISS_WARM_STANDBY and active_application != APP_EMBLISS:
+        # Alongside the Minilab wait: it shouldn't wait for embliss' imports
+        event_loop.create_task(prepare_embliss_standby(), name="embliss standby prepare")
     # The first display update will happen when the output port is confirmed open.
+    writer = event_loop.create_task(display_writer(), name="display writer")
+    stopping = event_loop.create_task(shutdown_requested.wait(), name="shutdown wait")
 
-    while True:
-        # ... (MIDI port finding logic remains similar) ...
-        if not target_input_port_name:
-            target_input_port_name = find_midi_input_port_name(MIDI_DEVICE_NAME_SUBSTRING)
-            if not target_input_port_name: time.sleep(10); continue
-        
-        if not target_output_port_name or (_midi_output_port_ref and _midi_output_port_ref.closed):
-            if _midi_output_port_ref and _midi_output_port_ref.closed:
-                 _midi_output_port_ref = None; target_output_port_name = None
-            
-            new_target_output_port_name = find_midi_output_port_name(MIDI_DEVICE_NAME_SUBSTRING)
-            if not new_target_output_port_name:
-                logging.warning(f"Output port '{MIDI_DEVICE_NAME_SUBSTRING}' not found.")
-                if target_output_port_name: # It was previously found but now lost
-                    target_output_port_name = None 
-            elif new_target_output_port_name != target_output_port_name : # New port found or first time
-                target_output_port_name = new_target_output_port_name
-                try:
-                    # Close if already open (e.g. changed port)
-                    if _midi_output_port_ref and not _midi_output_port_ref.closed: _midi_output_port_ref.close()
-                    _midi_output_port_ref = mido.open_output(target_output_port_name)
-                    logging.info(f"Successfully opened MIDI output on '{_midi_output_port_ref.name}' for main loop.")
-                    send_sysex_message(_midi_output_port_ref, SYSEX_INIT_DATA_TUPLE, "Minilab3 Init on Port Open")
-                    update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2) # Update based on current idle state
-                except Exception as e_out_open:
-                    logging.error(f"Failed to open MIDI output port '{target_output_port_name}': {e_out_open}")
-                    _midi_output_port_ref = None; target_output_port_name = None
-        
-        # If output port is still not available after checks, SysEx dependent operations will be skipped by helper functions
-        # So, we can proceed to open input port.
+    try:
+        while not shutdown_requested.is_set():
+            session = event_loop.create_task(minilab_session(), name="minilab session")
+            done, _ = await asyncio.wait({session, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if session not in done:
+                await shutdown()
+                session.cancel()
+                await asyncio.wait([session])
+                break
+            try:
+                if session.result():
+                    return
+            except OSError as e:
+                logging.error(f"MIDI port OS error: {e}. Reconnecting...")
+                await asyncio.wait([stopping], timeout=PORT_RETRY_DELAY)
+            except Exception as e:
+                logging.error(f"Unexpected error in main loop: {e}", exc_info=True)
+                await asyncio.wait([stopping], timeout=PORT_RETRY_DELAY)
+    finally:
+        writer.cancel()
+        stopping.cancel()
+        broker.detach()
+        broker.close()
 
-        try:
-            with mido.open_input(target_input_port_name) as in_port:
-                _midi_input_port_ref = in_port # Assign to global for signal handler
-                if not _midi_output_port_ref and target_output_port_name: # Try to open output if not already
-                    try:
-                        _midi_output_port_ref = mido.open_output(target_output_port_name)
-                        logging.info(f"MIDI output '{_midi_output_port_ref.name}' confirmed open within input context.")
-                        # If it's just opened, send init and idle display
-                        send_sysex_message(_midi_output_port_ref, SYSEX_INIT_DATA_TUPLE, "Minilab3 Init")
-                        update_minilab_display_if_idle(TEXT_CTRL_READY_L1, TEXT_CTRL_READY_L2)
-                    except Exception as e:
-                        logging.error(f"Error opening output port '{target_output_port_name}' in input context: {e}")
-                        _midi_output_port_ref = None
-
-
-                logging.info(f"Successfully opened MIDI input on '{in_port.name}'")
-                cc_modifier_held = False 
-                
-                if process_midi_input(in_port): 
-                    return 
-        
-        except OSError as e:
-            logging.error(f"MIDI port OS error (input: '{target_input_port_name}'): {e}. Reconnecting...")
-            if _midi_input_port_ref and not _midi_input_port_ref.closed: _midi_input_port_ref.close(); _midi_input_port_ref = None
-            if _midi_output_port_ref and not _midi_output_port_ref.closed: _midi_output_port_ref.close(); _midi_output_port_ref = None
-            target_input_port_name, target_output_port_name = None, None
-            time.sleep(5)
-        except Exception as e:
-            logging.error(f"Unexpected error in main loop: {e}", exc_info=True)
-            if _midi_input_port_ref and not _midi_input_port_ref.closed: _midi_input_port_ref.close(); _midi_input_port_ref = None
-            if _midi_output_port_ref and not _midi_output_port_ref.closed: _midi_output_port_ref.close(); _midi_output_port_ref = None
-            target_input_port_name, target_output_port_name = None, None
-            time.sleep(5)
+def main_loop():
+    """Runs the controller until SIGINT/SIGTERM or a reboot command."""
+    asyncio.run(run_controller())
 
 
 if __name__ == '__main__':
     # ... (startup checks remain the same) ...
+    trace('em_pd_controller', 'start')
     logging.info("em_pd_controller.py starting...")
     flash_pisound_leds_on_startup()
 
     if not os.path.exists(PD_PATH): logging.error(f"Critical: Pd executable not found at '{PD_PATH}'.")
     if not os.path.exists(PYTHON_EXEC): logging.error(f"Critical: Python for embliss not found at '{PYTHON_EXEC}'.")
     if not os.path.exists(EMBLISS_MAIN_SCRIPT): logging.error(f"Critical: Embliss main script not found at '{EMBLISS_MAIN_SCRIPT}'.")
-        
+
+    # Ready to take commands; the Minilab itself may still be on its way.
+    trace('em_pd_controller', 'ready')
+    notify_ready()
     main_loop()
     logging.info("em_pd_controller.py finished.")
\ No newline at end of file
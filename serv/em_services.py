@@ -0,0 +1,169 @@
+from multiprocessing import freeze_support
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+# Imported first so its logging format is the one that sticks.
+import em_pd_controller
+import em_midisetup
+from em_boot import notify_ready, since_boot_s, trace
+from em_clock import (DEFAULT_LATE_THRESHOLD_US, DEFAULT_OUTPUTS, MidiClockGen, add_clock_arguments,
+                      midi_bpm_listener, midi_clock_follower)
+
+CLOCK_IN_PORT = "em_clock_in"
+ROUTER_READY_TIMEOUT = 10.0
+# What Restart=always did for the separate em_midisetup unit
+ROUTER_RESTART_DELAY = 1.0
+
+# Units replaced by em_services.service, and what `measure` compares it against
+SPLIT_UNITS = ['em_clock', 'em_midisetup', 'em_pd_controller']
+UNIFIED_UNITS = ['em_services']
+
+class ServicesDaemon:
+    """em_clock, em_midisetup and em_pd_controller in one process.
+
+    The clock generator keeps its own (optionally realtime) process, since
+    its tick loop must not share a GIL with anything. The BPM listener and
+    the router run as threads here, and the controller owns the main thread
+    because it installs the signal handlers.
+    """
+    def __init__(self, timing_mode='hybrid', rt_priority=None, cpu=None, tempo_align='none', transport=False,
+                 outputs=None, follow_port=None, late_threshold_us=DEFAULT_LATE_THRESHOLD_US, status_file=None):
+        self.mcg = MidiClockGen(timing_mode, rt_priority, cpu, tempo_align, transport, follow=bool(follow_port),
+                                late_threshold_us=late_threshold_us)
+        self.outputs = outputs or DEFAULT_OUTPUTS
+        self.follow_port = follow_port
+        self.status_file = status_file
+
+    def _run_router(self, synced):
+        while True:
+            try:
+                em_midisetup.run(self.status_file, synced.set)
+            except Exception as e:
+                logging.error(f"Router failed, restarting in {ROUTER_RESTART_DELAY}s: {e}", exc_info=True)
+            time.sleep(ROUTER_RESTART_DELAY)
+
+    def _report_ready(self, started, synced):
+        if not self.mcg.ready.wait(ROUTER_READY_TIMEOUT):
+            logging.warning(f"Clock outputs did not open within {ROUTER_READY_TIMEOUT}s")
+        if synced.wait(ROUTER_READY_TIMEOUT):
+            trace('em_services', 'ready')
+            notify_ready()
+            logging.info(f"em_services ready in {time.monotonic() - started:.3f}s ({since_boot_s():.3f}s since boot)")
+        else:
+            # Report ready regardless so systemd doesn't kill the controller; the router keeps retrying.
+            logging.warning(f"Router did not complete a sync within {ROUTER_READY_TIMEOUT}s")
+            notify_ready(status="routing not yet in place")
+
+    def start(self):
+        started = time.monotonic()
+        self.mcg.launch_process(self.outputs)
+        try:
+            if self.follow_port:
+                # Slaved to an external clock: tempo and transport come from upstream, not Pd's CCs.
+                threading.Thread(target=midi_clock_follower, args=(self.mcg.tempo, self.follow_port),
+                                 name="clock-follower", daemon=True).start()
+            else:
+                threading.Thread(target=midi_bpm_listener, args=(self.mcg.tempo, CLOCK_IN_PORT),
+                                 name="clock-listener", daemon=True).start()
+
+            routes_synced = threading.Event()
+            threading.Thread(target=self._run_router, args=(routes_synced,), name="router", daemon=True).start()
+            threading.Thread(target=self._report_ready, args=(started, routes_synced), daemon=True).start()
+
+            em_pd_controller.main_loop()
+        finally:
+            self.mcg.end_process()
+            self.mcg.release()
+
+def _cgroup_pids(unit):
+    # A cgroup v2 cgroup.procs only lists processes directly in that cgroup. With app
+    # cgroups set up, the unit's own is empty and its processes are in the controller/ and
+    # embliss/ children, so read the whole subtree.
+    pids = []
+    for directory, _, _ in os.walk(f"/sys/fs/cgroup/system.slice/{unit}.service"):
+        try:
+            with open(os.path.join(directory, "cgroup.procs")) as f:
+                pids += [int(line) for line in f if line.strip()]
+        except OSError:
+            pass
+    return pids
+
+def _memory_kb(pid):
+    # Pss splits shared pages (libpython, rtmidi, libasound) fairly between processes.
+    memory = {'rss_kb': 0, 'pss_kb': 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    memory[f"{key.lower()}_kb"] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory
+
+def _start_since_boot_s(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        # Field 22 is the start time in clock ticks; split after the ')' ending the command name.
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+def measure_units(units):
+    """Memory and start time of each systemd unit's processes."""
+    results = []
+    for unit in units:
+        pids = _cgroup_pids(unit)
+        result = {'unit': unit, 'pids': pids, 'rss_kb': 0, 'pss_kb': 0, 'started_s': None}
+        for pid in pids:
+            for key, value in _memory_kb(pid).items():
+                result[key] += value
+            try:
+                start = _start_since_boot_s(pid)
+            except OSError:
+                continue
+            result['started_s'] = start if result['started_s'] is None else min(result['started_s'], start)
+        results.append(result)
+    running = [r for r in results if r['pids']]
+    total = {
+        'unit': 'total',
+        'rss_kb': sum(r['rss_kb'] for r in running),
+        'pss_kb': sum(r['pss_kb'] for r in running),
+        # Boot-to-ready comes from the "ready" log lines; this is when the last unit got going.
+        'last_started_s': max((r['started_s'] for r in running if r['started_s'] is not None), default=None),
+    }
+    return results + [total]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="emsys MIDI services (clock, router, controller) in one daemon")
+    # Same clock options as em_clock.py, so switching to this unit loses none of them
+    add_clock_arguments(parser)
+    parser.add_argument('--monitor', action='store_true',
+                        help="run the route monitor and write its JSON status file")
+    parser.add_argument('--status-file', default=em_midisetup.STATUS_FILE,
+                        help=f"route monitor status file (default: {em_midisetup.STATUS_FILE})")
+    subparsers = parser.add_subparsers(dest='command')
+    measure = subparsers.add_parser('measure', help="report RSS/PSS and start time of the running service units")
+    measure.add_argument('--units', nargs='+', metavar='UNIT',
+                         help=f"units to measure (default: {' '.join(UNIFIED_UNITS)} if it is running, "
+                              f"else {' '.join(SPLIT_UNITS)})")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    freeze_support()
+    args = parse_args()
+    if args.command == 'measure':
+        units = args.units or (UNIFIED_UNITS if _cgroup_pids(UNIFIED_UNITS[0]) else SPLIT_UNITS)
+        for result in measure_units(units):
+            print(json.dumps(result))
+    else:
+        trace('em_services', 'start')
+        logging.info("em_services starting...")
+        em_pd_controller.flash_pisound_leds_on_startup()
+        daemon = ServicesDaemon(args.timing, args.rt_priority, args.cpu, args.tempo_align, args.transport,
+                                args.outputs, args.follow, args.late_threshold_us,
+                                args.status_file if args.monitor else None)
+        daemon.start()
+        logging.info("em_services finished.")
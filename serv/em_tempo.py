@@ -0,0 +1,244 @@
+import os
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import Condition, Lock, resource_tracker, shared_memory
+
+# Field layout of the shared tempo block, after the leading sequence counter.
+# All fields are 8 bytes so every one stays naturally aligned.
+_FIELDS = (
+    ('bpm', 'd'),         # current target tempo
+    ('period_ns', 'q'),   # 24 PPQN pulse period derived from bpm
+    ('ramp_ticks', 'q'),  # pulses over which to glide to bpm, 0 = jump
+    ('tempo_id', 'Q'),    # bumped on every tempo change (not on start/stop)
+    ('running', 'q'),     # 1 while the clock should tick (CC 41 start/stop)
+    ('resume', 'q'),      # on start: 1 = continue from the current position, 0 = from the top
+    ('transport_id', 'Q'),  # bumped on every start/continue/stop command
+    ('seek_tick', 'q'),   # on continue: song position to resume from, -1 = where we stopped
+    ('follow_anchor_ns', 'q'),  # follow mode: predicted time of upstream tick follow_tick
+    ('follow_tick', 'q'),  # follow mode: upstream clocks received since start
+    ('run', 'q'),         # 0 asks the generator/listener processes to exit
+    ('generation', 'Q'),  # bumped on every write
+)
+
+# Song position, published by the generator alone after every tick.
+_POSITION_FIELDS = (
+    ('tick', 'q'),        # 24 PPQN clocks since song start
+    ('beat', 'q'),
+    ('bar', 'q'),         # assumes 4/4
+)
+
+_SEQ = struct.Struct('<Q')
+_BODY = struct.Struct('<' + ''.join(fmt for _, fmt in _FIELDS))
+_POSITION = struct.Struct('<' + ''.join(fmt for _, fmt in _POSITION_FIELDS))
+_BODY_OFFSET = _SEQ.size
+_POSITION_SEQ_OFFSET = _BODY_OFFSET + _BODY.size
+_POSITION_OFFSET = _POSITION_SEQ_OFFSET + _SEQ.size
+BLOCK_SIZE = _POSITION_OFFSET + _POSITION.size
+
+TempoSnapshot = namedtuple('TempoSnapshot', [name for name, _ in _FIELDS])
+SongPosition = namedtuple('SongPosition', [name for name, _ in _POSITION_FIELDS])
+
+# Reader retries before backing off. A write takes well under a microsecond, so
+# running out means the writer was preempted mid-write, maybe on the reader's core.
+_SEQLOCK_SPINS = 100
+# sched_yield() from a SCHED_FIFO reader never hands the core to a normal-priority
+# writer; only actually sleeping does.
+_SEQLOCK_BACKOFF = 0.00005
+
+def _read_seqlocked(buf, seq_offset, body, body_offset):
+    spins = 0
+    while True:
+        seq = _SEQ.unpack_from(buf, seq_offset)[0]
+        if not seq & 1:
+            values = body.unpack_from(buf, body_offset)
+            if _SEQ.unpack_from(buf, seq_offset)[0] == seq:
+                return values
+        spins += 1
+        if spins >= _SEQLOCK_SPINS:
+            time.sleep(_SEQLOCK_BACKOFF)
+            spins = 0
+
+def _write_seqlocked(buf, seq_offset, body, body_offset, values):
+    seq = _SEQ.unpack_from(buf, seq_offset)[0]
+    _SEQ.pack_into(buf, seq_offset, seq + 1)
+    body.pack_into(buf, body_offset, *values)
+    _SEQ.pack_into(buf, seq_offset, seq + 2)
+
+def period_ns_for_bpm(bpm):
+    return round(60_000_000_000 / (bpm * 24))
+
+def bpm_for_period_ns(period_ns):
+    return 60_000_000_000 / (period_ns * 24)
+
+class TempoState:
+    """Clock tempo and run state in one shared-memory block guarded by a seqlock.
+
+    Writers (the BPM listener and the app) are rare and serialise on a lock.
+    Readers, most importantly the tick loop, never take a lock: they retry the
+    read if the sequence counter was odd or moved while they were copying.
+    Every write also notifies the `changed` condition so an idle reader can
+    block until something happens instead of polling.
+
+    A second seqlocked section holds the song position. Only the generator
+    writes it, so it needs no writer lock at all.
+    """
+    def __init__(self, shm, lock, changed):
+        self.shm = shm
+        self.lock = lock
+        self.changed = changed
+
+    @classmethod
+    def create(cls, bpm=120, name=None):
+        shm = shared_memory.SharedMemory(name=name, create=True, size=BLOCK_SIZE)
+        state = cls(shm, Lock(), Condition())
+        shm.buf[:BLOCK_SIZE] = bytes(BLOCK_SIZE)
+        _BODY.pack_into(shm.buf, _BODY_OFFSET, *TempoSnapshot(
+            bpm=float(bpm), period_ns=period_ns_for_bpm(bpm), ramp_ticks=0, tempo_id=0,
+            running=1, resume=0, transport_id=0, seek_tick=-1, follow_anchor_ns=0, follow_tick=0,
+            run=1, generation=0))
+        return state
+
+    # memoryviews can't be pickled; child processes re-derive buf from the shm.
+    def __getstate__(self):
+        return {'shm': self.shm, 'lock': self.lock, 'changed': self.changed}
+
+    def __setstate__(self, state):
+        self.shm = state['shm']
+        self.lock = state['lock']
+        self.changed = state['changed']
+
+    def snapshot(self):
+        return TempoSnapshot._make(_read_seqlocked(self.shm.buf, 0, _BODY, _BODY_OFFSET))
+
+    def write(self, **fields):
+        return self._write(lambda current: fields)
+
+    def _write(self, changes):
+        # changes(current) -> dict of fields to replace, evaluated under the writer lock.
+        buf = self.shm.buf
+        with self.lock:
+            current = TempoSnapshot._make(_BODY.unpack_from(buf, _BODY_OFFSET))
+            updated = current._replace(generation=current.generation + 1, **changes(current))
+            _write_seqlocked(buf, 0, _BODY, _BODY_OFFSET, updated)
+        with self.changed:
+            self.changed.notify_all()
+        return updated
+
+    def position(self):
+        return SongPosition._make(_read_seqlocked(self.shm.buf, _POSITION_SEQ_OFFSET, _POSITION, _POSITION_OFFSET))
+
+    def publish_position(self, tick, ticks_per_beat=24, beats_per_bar=4):
+        beat = tick // ticks_per_beat
+        _write_seqlocked(self.shm.buf, _POSITION_SEQ_OFFSET, _POSITION, _POSITION_OFFSET,
+                         (tick, beat, beat // beats_per_bar))
+
+    def wait_for(self, predicate, timeout=None):
+        """Blocks until predicate(snapshot) is true or timeout expires; returns the last snapshot."""
+        with self.changed:
+            self.changed.wait_for(lambda: predicate(self.snapshot()), timeout)
+        return self.snapshot()
+
+    def set_bpm(self, bpm, ramp_ticks=0):
+        return self._write(lambda current: dict(
+            bpm=float(bpm), period_ns=period_ns_for_bpm(bpm),
+            ramp_ticks=int(ramp_ticks), tempo_id=current.tempo_id + 1))
+
+    def set_running(self, running, resume=False, seek_tick=-1, **fields):
+        return self._write(lambda current: dict(
+            running=1 if running else 0, resume=1 if resume else 0, seek_tick=seek_tick,
+            transport_id=current.transport_id + 1, **fields))
+
+    def set_run(self, run):
+        return self.write(run=1 if run else 0)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+# Generator telemetry, published under a fixed name so other processes can attach.
+STATS_NAME = 'em_clock_stats'
+
+_STATS_FIELDS = (
+    ('pid', 'q'),             # generator process
+    ('updated_ns', 'q'),      # wall clock (time.time_ns) of the last publish
+    ('bpm', 'd'),             # tempo the generator is currently ticking at
+    ('running', 'q'),
+    ('song_tick', 'q'),
+    ('ticks_sent', 'Q'),      # since the generator started, across start/stop
+    ('late_ticks', 'Q'),      # ticks sent more than late_threshold_ns after their deadline
+    ('late_threshold_ns', 'q'),
+    ('worst_late_ns', 'q'),
+    ('drift_ns', 'q'),        # lateness of the last tick
+    ('mean_drift_ns', 'q'),   # since the last start
+    ('resyncs', 'Q'),
+    ('cpu_ns', 'q'),          # process CPU time of the generator
+)
+
+_STATS = struct.Struct('<' + ''.join(fmt for _, fmt in _STATS_FIELDS))
+_STATS_OFFSET = _SEQ.size
+STATS_SIZE = _STATS_OFFSET + _STATS.size
+
+ClockStatsSnapshot = namedtuple('ClockStatsSnapshot', [name for name, _ in _STATS_FIELDS])
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # Running as another user
+    return True
+
+class ClockStats:
+    """Seqlocked telemetry block written by the clock generator alone.
+
+    Readers attach by name and never block the writer, so polling it (from a
+    CLI or a Pd helper) costs the tick loop nothing beyond the periodic publish.
+    """
+    def __init__(self, shm):
+        self.shm = shm
+
+    @classmethod
+    def create(cls, name=STATS_NAME):
+        """Creates the block, replacing one only if the process that owned it is gone."""
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=STATS_SIZE)
+        except FileExistsError:
+            existing = cls.attach(name)
+            owner = existing.snapshot().pid
+            existing.close()
+            if owner and _pid_alive(owner):
+                raise RuntimeError(f"Clock stats block '{name}' is in use by PID {owner}. Is another em_clock running?")
+            # Left behind by a generator that didn't shut down cleanly.
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=STATS_SIZE)
+        shm.buf[:STATS_SIZE] = bytes(STATS_SIZE)
+        stats = cls(shm)
+        # Ours until the generator publishes its own PID, so another instance can tell it's taken
+        stats.publish(ClockStatsSnapshot._make([0] * len(_STATS_FIELDS))._replace(pid=os.getpid()))
+        return stats
+
+    @classmethod
+    def attach(cls, name=STATS_NAME):
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            # Readers don't own the block; stop the resource tracker unlinking it on exit.
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm)
+
+    def snapshot(self):
+        return ClockStatsSnapshot._make(_read_seqlocked(self.shm.buf, 0, _STATS, _STATS_OFFSET))
+
+    def publish(self, stats):
+        _write_seqlocked(self.shm.buf, 0, _STATS, _STATS_OFFSET, stats)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()